@@ -0,0 +1,144 @@
+"""
+Fragment downloads against a local throttling HTTP server: fixed per-job concurrency
+(the old hardcoded 16 fragments) vs. allocations from services.BandwidthController.
+
+The server models a CDN: it accepts at most --server-limit concurrent connections from us,
+answers 429 beyond that, and while it keeps seeing rejections it serves every connection
+at a quarter of the normal rate.
+
+    python benchmarks/bench_bandwidth.py [--jobs 20] [--fragments 24]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from aiohttp import ClientSession, TCPConnector, web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import BandwidthController  # noqa: E402
+
+CHUNK = 64 * 1024
+HOST = "rr1---sn-bench.googlevideo.com"
+
+
+class ThrottlingServer:
+    def __init__(self, limit, fragment_size, rate, throttled_rate, cooldown=1.0):
+        self.limit = limit
+        self.fragment_size = fragment_size
+        self.rate = rate
+        self.throttled_rate = throttled_rate
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.peak = 0
+        self.rejected = 0
+        self.last_reject = 0.0
+
+    async def fragment(self, request):
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            self.last_reject = time.monotonic()
+            return web.Response(status=429)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            resp = web.StreamResponse()
+            resp.content_length = self.fragment_size
+            await resp.prepare(request)
+            sent = 0
+            while sent < self.fragment_size:
+                throttled = time.monotonic() - self.last_reject < self.cooldown
+                await resp.write(b"\0" * CHUNK)
+                sent += CHUNK
+                await asyncio.sleep(CHUNK / (self.throttled_rate if throttled else self.rate))
+            await resp.write_eof()
+            return resp
+        finally:
+            self.in_flight -= 1
+
+
+async def download_job(session, base, job, fragments, concurrency, on_throttle, retry_sleep):
+    queue = list(range(fragments))
+    received = 0
+
+    async def worker():
+        nonlocal received
+        while queue:
+            n = queue.pop()
+            while True:
+                async with session.get(f"{base}/frag/{job}/{n}") as resp:
+                    if resp.status == 429:
+                        on_throttle()
+                        await asyncio.sleep(retry_sleep)
+                        continue
+                    data = await resp.read()
+                    received += len(data)
+                    break
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return received
+
+
+async def run(mode, args):
+    server_state = ThrottlingServer(args.server_limit, args.fragment_kb * 1024, args.rate, args.rate / 4)
+    app = web.Application()
+    app.router.add_get("/frag/{job}/{n}", server_state.fragment)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    base = f"http://127.0.0.1:{port}"
+
+    controller = BandwidthController(args.budget, args.host_limit, args.max_fragments)
+
+    async def job(session, i):
+        if mode == "static":
+            return await download_job(session, base, i, args.fragments, 16, lambda: None, args.retry_sleep)
+        allocation = await controller.acquire(HOST)
+        try:
+            return await download_job(
+                session, base, i, args.fragments, allocation["fragments"],
+                lambda: controller.record_throttle(allocation), args.retry_sleep,
+            )
+        finally:
+            controller.release(allocation)
+
+    started = time.perf_counter()
+    async with ClientSession(connector=TCPConnector(limit=0)) as session:
+        total = sum(await asyncio.gather(*(job(session, i) for i in range(args.jobs))))
+    elapsed = time.perf_counter() - started
+    await runner.cleanup()
+    return {
+        "mode": mode,
+        "seconds": elapsed,
+        "mb_per_s": total / elapsed / 1e6,
+        "rejected": server_state.rejected,
+        "peak_connections": server_state.peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--fragments", type=int, default=24, help="fragments per job")
+    parser.add_argument("--fragment-kb", type=int, default=256)
+    parser.add_argument("--rate", type=float, default=4e6, help="bytes/s per connection when not throttled")
+    parser.add_argument("--server-limit", type=int, default=16, help="connections the server accepts")
+    parser.add_argument("--retry-sleep", type=float, default=0.2)
+    parser.add_argument("--budget", type=int, default=64)
+    parser.add_argument("--host-limit", type=int, default=24)
+    parser.add_argument("--max-fragments", type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'seconds':>9}{'MB/s':>9}{'429s':>8}{'peak conns':>12}")
+    for mode in ("static", "controller"):
+        result = asyncio.run(run(mode, args))
+        print(f"{result['mode']:<12}{result['seconds']:>9.2f}{result['mb_per_s']:>9.1f}"
+              f"{result['rejected']:>8}{result['peak_connections']:>12}")
+
+
+if __name__ == "__main__":
+    main()
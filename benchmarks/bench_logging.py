@@ -0,0 +1,119 @@
+"""
+Log records per second on the calling thread (the event loop, in the bot):
+the old setup, four uncompiled re.sub calls on msg plus a synchronous StreamHandler,
+vs. the current pipeline, a sampled DeferredQueueHandler feeding a QueueListener thread
+that redacts with one precompiled regex.
+
+The mix mimics a busy period: mostly sampled-out debug records, some info records,
+and warnings/errors carrying a long Update repr like error_handler's. Both loggers run at
+DEBUG, the level at which the hot-path records reach the handlers.
+
+    python benchmarks/bench_logging.py [--records 200000] [--debug-rate 0.01]
+"""
+import argparse
+import logging
+import os
+import queue
+import re
+import sys
+import time
+from logging.handlers import QueueListener
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logs import DeferredQueueHandler, PrivacyFilter, SamplingFilter  # noqa: E402
+
+UPDATE_REPR = (
+    "update_id=912345678 message=Message(message_id=4521, date=datetime.datetime(2024, 5, 1, 12, 0), "
+    "chat=Chat(id=123456789, type='private', username='someone'), from_user=User(id=123456789, "
+    "is_bot=False, first_name='A', username='someone', language_code='uz'), "
+    "text='https://www.instagram.com/reel/Cx1AbC2dEfG/?igsh=abc')"
+)
+
+
+class LegacyPrivacyFilter(logging.Filter):
+    """bot.py's filter before the queue pipeline"""
+    PATTERNS = [
+        (r'id=\d+', 'id=***'),
+        (r'token=[\w-]+', 'token=***'),
+        (r'@\w+', '@***'),
+        (r'\d{9,}', '***ID***'),
+    ]
+
+    def filter(self, record):
+        msg = str(record.msg)
+        for pattern, replacement in self.PATTERNS:
+            msg = re.sub(pattern, replacement, msg)
+        record.msg = msg
+        return True
+
+
+def emit_mix(logger, records):
+    for i in range(records):
+        kind = i % 100
+        if kind < 90:
+            logger.debug("progress job=%s fragment=%s speed=%s", i, kind, 1.5e6)
+        elif kind < 98:
+            logger.info("Job %s finished for user_id=%s", i, 123456789)
+        else:
+            logger.error("Update %s raised exception: %s", UPDATE_REPR, "TelegramBadRequest: message is not modified")
+
+
+def legacy(records, stream):
+    logger = logging.getLogger("bench.legacy")
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    handler.addFilter(LegacyPrivacyFilter())
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+    started = time.perf_counter()
+    emit_mix(logger, records)
+    elapsed = time.perf_counter() - started
+    logger.removeHandler(handler)
+    return elapsed, elapsed
+
+
+def pipeline(records, stream, debug_rate):
+    logger = logging.getLogger("bench.pipeline")
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler(stream)
+    output.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    output.addFilter(PrivacyFilter())
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter({}, debug_rate))
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+
+    started = time.perf_counter()
+    emit_mix(logger, records)
+    caller = time.perf_counter() - started
+    listener.stop()  # drains the queue
+    total = time.perf_counter() - started
+    logger.removeHandler(handler)
+    return caller, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--debug-rate", type=float, default=0.01, help="DEBUG_SAMPLE_RATE for the pipeline")
+    args = parser.parse_args()
+
+    with open(os.devnull, "w") as stream:
+        results = {
+            "before": legacy(args.records, stream),
+            "after": pipeline(args.records, stream, args.debug_rate),
+        }
+
+    print(f"{'setup':<8}{'caller rec/s':>14}{'end-to-end rec/s':>18}")
+    for name, (caller, total) in results.items():
+        print(f"{name:<8}{args.records / caller:>14,.0f}{args.records / total:>18,.0f}")
+
+
+if __name__ == "__main__":
+    main()
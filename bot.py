@@ -1,10 +1,17 @@
+import time
+_import_started = time.perf_counter()
 import os
 import asyncio
+import atexit
 import logging
+import queue
+from logging.handlers import QueueListener
 import re
+import html
+import random
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.filters import Command
-from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InlineQuery, InlineQueryResultCachedAudio, InlineQueryResultCachedVideo
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
@@ -14,32 +21,30 @@ from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_applicati
 from aiohttp import web
 
 # Import local modules
-from config import BOT_TOKEN, ADMIN_IDS, DOWNLOAD_PATH
-from database import init_db, add_user, get_stats, add_channel, remove_channel, get_channels, get_all_users, check_admin, set_admin
-from services import download_media, recognize_music, search_and_download_song
-from middlewares import ForceSubMiddleware
+from config import BOT_TOKEN, ADMIN_IDS, DOWNLOAD_PATH, MAX_DURATION, MAX_JOB_ATTEMPTS, JOB_BACKOFF_BASE, JOB_BACKOFF_MAX, JOB_RESUME_WINDOW, ANALYTICS_FLUSH_INTERVAL, WARM_UP_IMPORTS, LOG_LEVEL, DEBUG_SAMPLE_RATE, LOG_SAMPLE_RATES
+from database import init_db, add_user, get_stats, add_channel, remove_channel, get_channels, get_all_users, check_admin, set_admin, add_job, update_job, get_unfinished_jobs, track_event, flush_events, get_dashboard, add_cached_media, search_cached_media
+from services import download_media, probe_media, recognize_music, search_and_download_song, close_http_session, reclaim_downloads, TransientDownloadError, platform_of, warm_up, canonicalize_url, LINK_PATTERN, get_extractor_stats
+from middlewares import ForceSubMiddleware, RateLimitMiddleware
+from logs import PrivacyFilter, SamplingFilter, DeferredQueueHandler
+
+# Cold-start breakdown (seconds), printed at startup and shown on the status page
+STARTUP_TIMINGS = {'imports': time.perf_counter() - _import_started}
 
 # --- PRIVACY-ENHANCED LOGGING ---
-class PrivacyFilter(logging.Filter):
-    """Filters out sensitive data from logs"""
-    PATTERNS = [
-        (r'id=\d+', 'id=***'),
-        (r'token=[\w-]+', 'token=***'),
-        (r'@\w+', '@***'),
-        (r'\d{9,}', '***ID***'),
-    ]
-    
-    def filter(self, record):
-        msg = str(record.msg)
-        for pattern, replacement in self.PATTERNS:
-            msg = re.sub(pattern, replacement, msg)
-        record.msg = msg
-        return True
+# Handlers only enqueue records; redaction, formatting and I/O run on the
+# QueueListener thread so logging never blocks the event loop.
+log_queue = queue.SimpleQueue()
+log_output = logging.StreamHandler()
+log_output.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+log_output.addFilter(PrivacyFilter())
 
-# Apply privacy filter
-logging.basicConfig(level=logging.WARNING)  # Reduce log verbosity
-for handler in logging.root.handlers:
-    handler.addFilter(PrivacyFilter())
+log_input = DeferredQueueHandler(log_queue)
+log_input.addFilter(SamplingFilter(LOG_SAMPLE_RATES, DEBUG_SAMPLE_RATE))
+
+logging.basicConfig(level=LOG_LEVEL, handlers=[log_input])  # WARNING by default to reduce verbosity
+log_listener = QueueListener(log_queue, log_output, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 # Bot Setup
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
@@ -50,6 +55,10 @@ WEBHOOK_PATH = "/webhook"
 WEBHOOK_PORT = int(os.getenv("PORT", 8080))
 
 # Register Middleware for ALL event types
+# Rate limit first: it is O(1) and shields the subscription check's API calls
+rate_limiter = RateLimitMiddleware()
+dp.message.middleware(rate_limiter)
+dp.callback_query.middleware(rate_limiter)
 dp.message.middleware(ForceSubMiddleware())
 dp.callback_query.middleware(ForceSubMiddleware())
 
@@ -60,12 +69,25 @@ class AppStates(StatesGroup):
     waiting_for_admin_id = State()
     waiting_for_admin_remove = State()
 
+# Fetched once at startup instead of a get_me() round trip for every caption
+bot_username = None
+
+async def load_bot_identity():
+    global bot_username
+    bot_username = (await bot.get_me()).username
+
 # --- HELPER: CHECK ADMIN ---
 async def is_admin(user_id):
     if user_id in ADMIN_IDS:
         return True
     return await check_admin(user_id)
 
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
 # --- USER HANDLERS ---
 @dp.message(Command("start"))
 async def start_handler(message: types.Message):
@@ -119,7 +141,7 @@ async def admin_add_channel_handler(message: types.Message, state: FSMContext):
         
         # 2. Verify Bot Admin
         try:
-            chat_member = await bot.get_chat_member(chat_id=ch_id, user_id=(await bot.get_me()).id)
+            chat_member = await bot.get_chat_member(chat_id=ch_id, user_id=bot.id)
             if chat_member.status not in ['administrator', 'creator']:
                 await message.reply("🚫 <b>Xatolik!</b> Bot bu kanalda admin emas.")
                 return
@@ -168,95 +190,298 @@ async def admin_broadcast_handler(message: types.Message, state: FSMContext):
     await state.clear()
 
 # --- DOWNLOAD HANDLER (Links) ---
-@dp.message(F.text.regexp(r'(https?://(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|www\.[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|https?://(?:www\.|(?!www))[a-zA-Z0-9]+\.[^\s]{2,})'))
+@dp.message(F.text.regexp(LINK_PATTERN))
 async def link_handler(message: types.Message):
+    # Probing can take a few seconds; show progress right away and edit it into the result
+    status_msg = await message.reply("🔎 <b>Havola tekshirilmoqda...</b>")
+    url = await canonicalize_url(message.text)
+    info, error = await probe_media(url)
+    if error == 'unavailable':
+        await status_msg.edit_text("😔 Bu havola hozircha mavjud emas yoki himoyalangan. Boshqa havola bilan urining.")
+        return
+    if error == 'live':
+        await status_msg.edit_text("📡 Jonli efirni yuklab bo'lmaydi.")
+        return
+    if error == 'too_long':
+        await status_msg.edit_text(f"⏱ Video juda uzun. Maksimal davomiylik: {format_duration(MAX_DURATION)}.")
+        return
+
+    video_text = "📹 Video"
+    text = "� <b>Formatni tanlang:</b>"
+    if info:
+        if info['filesize']:
+            video_text += f" ({info['filesize'] / (1024 * 1024):.1f} MB)"
+        details = f"🎬 <b>{html.escape(info['title'][:100])}</b>"
+        if info['duration']:
+            details += f"\n⏱ {format_duration(info['duration'])}"
+        text = f"{details}\n\n{text}"
+
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="📹 Video", callback_data="dl_video"),
+            InlineKeyboardButton(text=video_text, callback_data="dl_video"),
             InlineKeyboardButton(text="🎵 Musiqa (To'liq)", callback_data="dl_music")
         ]
     ])
-    await message.reply("� <b>Formatni tanlang:</b>", reply_markup=keyboard)
+    await status_msg.edit_text(text, reply_markup=keyboard)
 
-@dp.callback_query(F.data == "dl_video")
-async def video_callback_handler(callback: CallbackQuery):
-    if not callback.message.reply_to_message or not callback.message.reply_to_message.text:
-        await callback.answer("❌ Havola topilmadi.", show_alert=True)
-        return
-        
-    url = callback.message.reply_to_message.text.strip()
-    await callback.answer(cache_time=1)
-    status_msg = await callback.message.reply("⏳ <b>Video yuklanmoqda...</b>")
-    
-    file_path, title, media_type = await download_media(url)
+# --- JOBS ---
+# Every download/recognition is recorded in the jobs table before it starts,
+# so a restart can pick it up again (or at least tell the user it failed).
+_background_tasks = set()
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def edit_status(chat_id, status_id, text):
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=status_id)
+    except Exception:
+        pass
+
+async def delete_status(chat_id, status_id):
+    try:
+        await bot.delete_message(chat_id=chat_id, message_id=status_id)
+    except Exception:
+        pass
+
+def remove_file(path):
+    if path and os.path.exists(path):
+        try: os.remove(path)
+        except: pass
+
+async def timed_download(user_id, url):
+    started = time.monotonic()
+    ok = False
+    try:
+        file_path, title, media_type = await download_media(url)
+        ok = bool(file_path and os.path.exists(file_path))
+        return file_path, title, media_type
+    finally:
+        # Also reached on TransientDownloadError, so retried failures count in the success rates
+        track_event('download', platform_of(url), ok, time.monotonic() - started, user_id)
+
+async def timed_recognition(user_id, file_path):
+    started = time.monotonic()
+    result = None
+    try:
+        result = await recognize_music(file_path)
+        return result
+    finally:
+        track_event('recognition', 'shazam', bool(result), time.monotonic() - started, user_id)
+
+async def timed_search(user_id, query):
+    started = time.monotonic()
+    ok = False
+    try:
+        mp3_path, info = await search_and_download_song(query)
+        ok = bool(mp3_path and os.path.exists(mp3_path))
+        return mp3_path, info
+    finally:
+        track_event('search', 'youtube', ok, time.monotonic() - started, user_id)
+
+async def remember_media(sent, user_id, title, performer=None):
+    """Adds a delivered audio/video to the inline-mode index. Never breaks delivery."""
+    try:
+        if sent.audio:
+            await add_cached_media(sent.audio.file_unique_id, sent.audio.file_id, 'audio', title, performer, user_id)
+        elif sent.video:
+            await add_cached_media(sent.video.file_unique_id, sent.video.file_id, 'video', title, performer, user_id)
+    except Exception as e:
+        logging.warning("Media index error: %s", e)
+
+def backoff_delay(attempt):
+    """Exponential backoff with jitter for the n-th failed attempt (1-based)."""
+    return min(JOB_BACKOFF_BASE * 2 ** (attempt - 1), JOB_BACKOFF_MAX) + random.uniform(0, 1)
+
+async def send_full_song(chat_id, status_id, user_id, result, search_query, caption, failed_text):
+    """Shared tail of the recognition jobs: find the full MP3 for a Shazam match and send it."""
+    await edit_status(chat_id, status_id, f"✅ <b>Topildi!</b>\n🎤 {result['subtitle']} - {result['title']}\n🔍 <b>To'liq MP3 yuklanmoqda...</b>")
+    # Retried here rather than by execute_job, which would redo the download and Shazam
+    for attempt in range(1, MAX_JOB_ATTEMPTS + 1):
+        try:
+            mp3_path, info = await timed_search(user_id, search_query)
+            break
+        except TransientDownloadError:
+            if attempt >= MAX_JOB_ATTEMPTS:
+                return False
+            await asyncio.sleep(backoff_delay(attempt))
+
+    if mp3_path and os.path.exists(mp3_path):
+        try:
+            sent = await bot.send_audio(
+                chat_id=chat_id,
+                audio=FSInputFile(mp3_path),
+                title=result['title'],
+                performer=result['subtitle'],
+                caption=caption
+            )
+            await remember_media(sent, user_id, result['title'], result['subtitle'])
+            await delete_status(chat_id, status_id)
+        except:
+            await edit_status(chat_id, status_id, failed_text)
+        finally:
+            remove_file(mp3_path)
+        return True
+    return False
+
+async def run_video_job(chat_id, status_id, url, user_id):
+    file_path, title, media_type = await timed_download(user_id, url)
     
     if file_path and os.path.exists(file_path):
         try:
-            await status_msg.edit_text("📤 <b>Video yuklanmoqda biroz kuting😊...</b>")
+            await edit_status(chat_id, status_id, "📤 <b>Video yuklanmoqda biroz kuting😊...</b>")
             file_to_send = FSInputFile(file_path)
-            caption_text = f"📹 <b>{title}</b>\n🤖 @{ (await bot.get_me()).username}"
+            caption_text = f"📹 <b>{title}</b>\n🤖 @{bot_username}"
             
             if media_type == 'image':
-                await callback.message.answer_photo(photo=file_to_send, caption=caption_text)
+                sent = await bot.send_photo(chat_id=chat_id, photo=file_to_send, caption=caption_text)
             elif media_type == 'audio':
-                await callback.message.answer_audio(audio=file_to_send, caption=caption_text)
+                sent = await bot.send_audio(chat_id=chat_id, audio=file_to_send, caption=caption_text)
             else:
-                await callback.message.answer_video(video=file_to_send, caption=caption_text)
-            await status_msg.delete()
+                sent = await bot.send_video(chat_id=chat_id, video=file_to_send, caption=caption_text)
+            await remember_media(sent, user_id, title)
+            await delete_status(chat_id, status_id)
         except:
-            await status_msg.edit_text("😔 Afsuski, bu videoni yuborib bo'lmadi. Boshqa havola bilan urining.")
+            await edit_status(chat_id, status_id, "😔 Afsuski, bu videoni yuborib bo'lmadi. Boshqa havola bilan urining.")
         finally:
-            if os.path.exists(file_path): 
-                try: os.remove(file_path)
-                except: pass
+            remove_file(file_path)
     else:
-        await status_msg.edit_text("😔 Bu havola hozircha mavjud emas yoki himoyalangan. Boshqa havola bilan urining.")
+        await edit_status(chat_id, status_id, "😔 Bu havola hozircha mavjud emas yoki himoyalangan. Boshqa havola bilan urining.")
 
-@dp.callback_query(F.data == "dl_music")
-async def music_callback_handler(callback: CallbackQuery):
-    if not callback.message.reply_to_message or not callback.message.reply_to_message.text:
-        await callback.answer("❌ Havola topilmadi.", show_alert=True)
-        return
-
-    url = callback.message.reply_to_message.text.strip()
-    await callback.answer(cache_time=1)
-    status_msg = await callback.message.reply("🎵 <b>Musiqa aniqlanmoqda ..</b>")
-    
-    file_path, title, _ = await download_media(url)
+async def run_music_job(chat_id, status_id, url, user_id):
+    file_path, title, _ = await timed_download(user_id, url)
     if not file_path or not os.path.exists(file_path):
-        await status_msg.edit_text("😔 Bu video hozircha mavjud emas. Boshqa havola bilan urining.")
+        await edit_status(chat_id, status_id, "😔 Bu video hozircha mavjud emas. Boshqa havola bilan urining.")
         return
 
-    result = await recognize_music(file_path)
-    if os.path.exists(file_path):
-        try: os.remove(file_path)
-        except: pass
+    try:
+        result = await timed_recognition(user_id, file_path)
+    finally:
+        remove_file(file_path)
 
     if result:
-        await status_msg.edit_text(f"✅ <b>Topildi!</b>\n🎤 {result['subtitle']} - {result['title']}\n🔍 <b>To'liq MP3 yuklanmoqda...</b>")
-        search_query = f"{result['subtitle']} - {result['title']}"
-        mp3_path, info = await search_and_download_song(search_query)
+        sent = await send_full_song(
+            chat_id, status_id, user_id, result,
+            f"{result['subtitle']} - {result['title']}",
+            "🤖 @yuklovchishazam_bot - To'liq musiqa",
+            "😔 Musiqa yuborib bo'lmadi. Keyinroq urinib ko'ring."
+        )
+        if not sent:
+            await edit_status(chat_id, status_id, f"⚠️ Musiqa topildi, lekin MP3 yuklab bo'lmadi.\n🔗 <a href='{result['url']}'>Shazam</a>")
+    else:
+        await edit_status(chat_id, status_id, "🎵 Musiqa aniqlanmadi. Aniqroq qism bilan urining.")
+
+async def run_recognize_job(chat_id, status_id, file_id, user_id):
+    file = await bot.get_file(file_id)
+    file_path = f"{DOWNLOAD_PATH}/{file_id}.tmp"
+    try:
+        await bot.download_file(file.file_path, file_path)
+        result = await timed_recognition(user_id, file_path)
+    finally:
+        remove_file(file_path)
         
-        if mp3_path and os.path.exists(mp3_path):
-            try:
-                audio_file = FSInputFile(mp3_path)
-                await callback.message.answer_audio(
-                    audio=audio_file,
-                    title=result['title'],
-                    performer=result['subtitle'],
-                    caption="🤖 @yuklovchishazam_bot - To'liq musiqa"
-                )
-                await status_msg.delete()
-            except:
-                await status_msg.edit_text("😔 Musiqa yuborib bo'lmadi. Keyinroq urinib ko'ring.")
-            finally:
-                if os.path.exists(mp3_path):
-                    try: os.remove(mp3_path)
-                    except: pass
-        else:
-            await status_msg.edit_text(f"⚠️ Musiqa topildi, lekin MP3 yuklab bo'lmadi.\n🔗 <a href='{result['url']}'>Shazam</a>")
+    if result:
+        sent = await send_full_song(
+            chat_id, status_id, user_id, result,
+            f"{result['subtitle']} {result['title']}",
+            "🤖 @yuklovchishazam_bot",
+            "😔 Musiqa yuborib bo'lmadi."
+        )
+        if not sent:
+            await edit_status(chat_id, status_id, f"✅ <b>{result['title']}</b> topildi!\n📀 {result['subtitle']}\n🔗 <a href='{result['url']}'>Shazam'da ochish</a>")
     else:
-        await status_msg.edit_text("🎵 Musiqa aniqlanmadi. Aniqroq qism bilan urining.")
+        await edit_status(chat_id, status_id, "🎵 Musiqa aniqlanmadi. Boshqa qism bilan urining.")
+
+async def run_search_job(chat_id, status_id, query, user_id):
+    mp3_path, info = await timed_search(user_id, query)
+    
+    if mp3_path and os.path.exists(mp3_path):
+        try:
+            await edit_status(chat_id, status_id, "📤 <b>Yuklanmoqda...</b>")
+            audio_file = FSInputFile(mp3_path)
+            title = info.get('title', query)
+            performer = info.get('uploader', 'Music Bot')
+            sent = await bot.send_audio(chat_id=chat_id, audio=audio_file, title=title, performer=performer, caption=f"🎧 <b>{title}</b>\n🤖 @{bot_username}")
+            await remember_media(sent, user_id, title, performer)
+            await delete_status(chat_id, status_id)
+        except:
+            await edit_status(chat_id, status_id, "❌ Yuborishda xatolik.")
+        finally:
+            remove_file(mp3_path)
+    else:
+        await edit_status(chat_id, status_id, "❌ Topilmadi.")
+
+JOB_RUNNERS = {
+    'video': run_video_job,
+    'music': run_music_job,
+    'recognize': run_recognize_job,
+    'search': run_search_job,
+}
+
+async def execute_job(job_id, kind, payload, chat_id, status_id, user_id, attempts=0):
+    """Runs a job, retrying transient download errors with exponential backoff."""
+    runner = JOB_RUNNERS[kind]
+    while True:
+        attempts += 1
+        await update_job(job_id, 'running', attempts)
+        try:
+            await runner(chat_id, status_id, payload, user_id)
+            await update_job(job_id, 'done', attempts)
+            return
+        except TransientDownloadError as e:
+            if attempts >= MAX_JOB_ATTEMPTS:
+                await update_job(job_id, 'failed', attempts, str(e))
+                await edit_status(chat_id, status_id, "😔 Hozir yuklab bo'lmadi. Birozdan keyin qayta urinib ko'ring.")
+                return
+            await edit_status(chat_id, status_id, f"🔁 <b>Qayta urinilmoqda ({attempts}/{MAX_JOB_ATTEMPTS})...</b>")
+            await asyncio.sleep(backoff_delay(attempts))
+        except Exception as e:
+            await update_job(job_id, 'failed', attempts, str(e))
+            await edit_status(chat_id, status_id, "😔 Kechirasiz, hozir xizmat mavjud emas.")
+            return
+
+async def start_job(kind, payload, status_msg, user_id):
+    job_id = await add_job(kind, payload, status_msg.chat.id, status_msg.message_id, user_id)
+    await execute_job(job_id, kind, payload, status_msg.chat.id, status_msg.message_id, user_id)
+
+async def recover_jobs():
+    """Resumes jobs interrupted by a restart, or fails them gracefully if they are stale."""
+    for job_id, kind, payload, chat_id, status_id, user_id, attempts, age in await get_unfinished_jobs():
+        if kind not in JOB_RUNNERS or attempts >= MAX_JOB_ATTEMPTS or age > JOB_RESUME_WINDOW:
+            await update_job(job_id, 'failed', attempts, 'interrupted')
+            await edit_status(chat_id, status_id, "♻️ Bot qayta ishga tushdi va so'rov bajarilmadi. Iltimos, qaytadan yuboring.")
+            continue
+        await edit_status(chat_id, status_id, "♻️ <b>Bot qayta ishga tushdi, davom ettirilmoqda...</b>")
+        spawn(execute_job(job_id, kind, payload, chat_id, status_id, user_id, attempts))
+
+@dp.callback_query(F.data == "dl_video")
+async def video_callback_handler(callback: CallbackQuery):
+    url = None
+    if callback.message.reply_to_message and callback.message.reply_to_message.text:
+        url = await canonicalize_url(callback.message.reply_to_message.text)
+    if not url:
+        await callback.answer("❌ Havola topilmadi.", show_alert=True)
+        return
+        
+    await callback.answer(cache_time=1)
+    status_msg = await callback.message.reply("⏳ <b>Video yuklanmoqda...</b>")
+    await start_job('video', url, status_msg, callback.from_user.id)
+
+@dp.callback_query(F.data == "dl_music")
+async def music_callback_handler(callback: CallbackQuery):
+    url = None
+    if callback.message.reply_to_message and callback.message.reply_to_message.text:
+        url = await canonicalize_url(callback.message.reply_to_message.text)
+    if not url:
+        await callback.answer("❌ Havola topilmadi.", show_alert=True)
+        return
+
+    await callback.answer(cache_time=1)
+    status_msg = await callback.message.reply("🎵 <b>Musiqa aniqlanmoqda ..</b>")
+    await start_job('music', url, status_msg, callback.from_user.id)
 
 # --- MUSIC RECOGNITION HANDLER (Files) ---
 @dp.message(F.video | F.audio | F.voice | F.video_note)
@@ -277,42 +502,7 @@ async def file_recognition_handler(message: types.Message):
             await status_msg.edit_text("😔 Bu turdagi fayl qo'llab-quvvatlanmaydi.")
             return
         
-        file = await bot.get_file(file_id)
-        file_path = f"{DOWNLOAD_PATH}/{file_id}.tmp"
-        await bot.download_file(file.file_path, file_path)
-        
-        result = await recognize_music(file_path)
-        
-        # Cleanup
-        if os.path.exists(file_path):
-            try: os.remove(file_path)
-            except: pass
-            
-        if result:
-            await status_msg.edit_text(f"✅ <b>Topildi!</b>\n🎤 {result['subtitle']} - {result['title']}\n🔍 <b>To'liq MP3 yuklanmoqda...</b>")
-            search_query = f"{result['subtitle']} {result['title']}"
-            mp3_path, info = await search_and_download_song(search_query)
-            
-            if mp3_path and os.path.exists(mp3_path):
-                try:
-                    audio_file = FSInputFile(mp3_path)
-                    await message.answer_audio(
-                        audio=audio_file, 
-                        title=result['title'], 
-                        performer=result['subtitle'], 
-                        caption="🤖 @yuklovchishazam_bot"
-                    )
-                    await status_msg.delete()
-                except:
-                    await status_msg.edit_text("😔 Musiqa yuborib bo'lmadi.")
-                finally:
-                    if os.path.exists(mp3_path):
-                        try: os.remove(mp3_path)
-                        except: pass
-            else:
-                await status_msg.edit_text(f"✅ <b>{result['title']}</b> topildi!\n📀 {result['subtitle']}\n🔗 <a href='{result['url']}'>Shazam'da ochish</a>")
-        else:
-            await status_msg.edit_text("🎵 Musiqa aniqlanmadi. Boshqa qism bilan urining.")
+        await start_job('recognize', file_id, status_msg, message.from_user.id)
     except Exception:
         await message.reply("😔 Kechirasiz, hozir xizmat mavjud emas.")
 
@@ -321,29 +511,51 @@ async def file_recognition_handler(message: types.Message):
 async def text_music_handler(message: types.Message):
     query = message.text.strip()
     status_msg = await message.reply(f"🔎 <b>'{query}'</b> qidirilmoqda...")
-    mp3_path, info = await search_and_download_song(query)
-    
-    if mp3_path and os.path.exists(mp3_path):
-        try:
-            await status_msg.edit_text("📤 <b>Yuklanmoqda...</b>")
-            audio_file = FSInputFile(mp3_path)
-            title = info.get('title', query)
-            performer = info.get('uploader', 'Music Bot')
-            await message.answer_audio(audio=audio_file, title=title, performer=performer, caption=f"🎧 <b>{title}</b>\n🤖 @{(await bot.get_me()).username}")
-            await status_msg.delete()
-        except:
-             await status_msg.edit_text("❌ Yuborishda xatolik.")
-        finally:
-            if os.path.exists(mp3_path):
-                try: os.remove(mp3_path)
-                except: pass
-    else:
-        await status_msg.edit_text("❌ Topilmadi.")
+    await start_job('search', query, status_msg, message.from_user.id)
+
+# --- INLINE MODE ---
+# Answered only from the local index of already-delivered media: no downloads on this path.
+INLINE_PAGE_SIZE = 20
+
+@dp.inline_query()
+async def inline_query_handler(inline_query: InlineQuery):
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    rows = await search_cached_media(inline_query.query, inline_query.from_user.id, offset=offset, limit=INLINE_PAGE_SIZE)
+
+    results = []
+    for media_id, file_id, kind, title, performer in rows:
+        if kind == 'audio':
+            results.append(InlineQueryResultCachedAudio(id=str(media_id), audio_file_id=file_id))
+        else:
+            results.append(InlineQueryResultCachedVideo(id=str(media_id), video_file_id=file_id, title=(title or 'Video')[:64]))
+
+    next_offset = str(offset + INLINE_PAGE_SIZE) if len(rows) == INLINE_PAGE_SIZE else ""
+    # An empty query lists the caller's own deliveries, so that answer must not be shared
+    personal = not re.search(r'\w', inline_query.query)
+    await inline_query.answer(results, cache_time=300, is_personal=personal, next_offset=next_offset)
 
 # --- ADMIN PANEL ---
 # --- ADMIN PANEL LOGIC ---
+async def analytics_worker():
+    """Writes buffered analytics events to the DB in batches."""
+    while True:
+        await asyncio.sleep(ANALYTICS_FLUSH_INTERVAL)
+        await flush_events()
+
+def success_rate(kinds, kind):
+    total, success = kinds.get(kind, (0, 0))
+    return f"{success * 100 // total}% ({total})" if total else "—"
+
+def format_extractor_stats(separator):
+    """Success rate and average latency per extractor since the process started"""
+    return separator.join(
+        f"{name}: {stats['success_rate']:.0%} ({stats['attempts']}), {stats['avg_latency']:.1f} s"
+        for name, stats in sorted(get_extractor_stats().items())
+    ) or "—"
+
 async def show_admin_ui(target, is_callback=False):
     stats = await get_stats()
+    dashboard = await get_dashboard(days=7)
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📢 Kanallar", callback_data="admin_channels"),
          InlineKeyboardButton(text="➕ Kanal qo'shish", callback_data="admin_add_channel")],
@@ -354,9 +566,21 @@ async def show_admin_ui(target, is_callback=False):
         [InlineKeyboardButton(text="🗑 Kanal o'chirish", callback_data="admin_del_channel_menu")]
     ])
     
+    top_platforms = ", ".join(f"{name} ({count})" for name, count in dashboard['top_platforms']) or "—"
+    p95 = f"≤{dashboard['p95_download_ms'] / 1000:g} s" if dashboard['p95_download_ms'] else "—"
+    extractors = format_extractor_stats("\n")
     text = (
         f"⚙️ <b>Admin Panel</b>\n\n"
-        f"👥 <b>Jami foydalanuvchilar:</b> {stats}\n\n"
+        f"👥 <b>Jami foydalanuvchilar:</b> {stats}\n"
+        f"📈 <b>DAU / MAU:</b> {dashboard['dau']} / {dashboard['mau']}\n\n"
+        f"📊 <b>Oxirgi 7 kun:</b>\n"
+        f"🔝 Platformalar: {top_platforms}\n"
+        f"📹 Yuklash: {success_rate(dashboard['kinds'], 'download')}\n"
+        f"🎵 Aniqlash: {success_rate(dashboard['kinds'], 'recognition')}\n"
+        f"🔎 Qidiruv: {success_rate(dashboard['kinds'], 'search')}\n"
+        f"⚡ Keshdan: {dashboard['kinds'].get('cache_hit', (0, 0))[0]}\n"
+        f"⏱ Yuklash p95: {p95}\n\n"
+        f"🧩 <b>Extractorlar:</b>\n{extractors}\n\n"
         "Boshqaruv uchun tugmani bosing:"
     )
 
@@ -518,26 +742,55 @@ async def admin_delete_channel_handler(callback: CallbackQuery):
 # --- GLOBAL ERROR HANDLER ---
 @dp.error()
 async def error_handler(event, exception):
-    logging.error(f"Update {event} raised exception: {exception}")
+    # Lazy %-args: the Update repr is only built on the logging thread
+    logging.error("Update %s raised exception: %s", event, exception)
     return True  # Prevent crash
 
 # --- START BOT ---
+async def timed(name, coro):
+    started = time.perf_counter()
+    result = await coro
+    STARTUP_TIMINGS[name] = time.perf_counter() - started
+    return result
+
+async def warm_up_task():
+    STARTUP_TIMINGS['warm_up'] = await warm_up()
+    print(f"🔥 yt-dlp/shazamio yuklandi: {STARTUP_TIMINGS['warm_up']:.2f}s")
+
+def format_timings(separator):
+    return separator.join(f"{name}: {seconds:.2f}s" for name, seconds in STARTUP_TIMINGS.items())
+
+async def prepare_startup():
+    """Startup steps shared by webhook and polling mode."""
+    await timed('db_init', init_db())
+    if not os.path.exists(DOWNLOAD_PATH): os.makedirs(DOWNLOAD_PATH)
+    reclaim_downloads()
+    await timed('get_me', load_bot_identity())
+    spawn(recover_jobs())
+    spawn(analytics_worker())
+
 async def on_startup(app):
     """Called when webhook server starts"""
-    await init_db()
-    if not os.path.exists(DOWNLOAD_PATH): os.makedirs(DOWNLOAD_PATH)
+    await prepare_startup()
     
     # Set webhook URL from environment
     webhook_url = os.getenv("WEBHOOK_URL", "").rstrip("/")
     if webhook_url:
-        await bot.set_webhook(f"{webhook_url}{WEBHOOK_PATH}")
+        await timed('set_webhook', bot.set_webhook(f"{webhook_url}{WEBHOOK_PATH}"))
         print(f"🤖 Bot ishga tushdi (webhook mode): {webhook_url}")
     else:
         print("⚠️ WEBHOOK_URL topilmadi!")
+    print(f"⏱ Startup: {format_timings(', ')}")
+
+    # Heavy imports are otherwise deferred to the first job
+    if WARM_UP_IMPORTS:
+        spawn(warm_up_task())
 
 async def on_shutdown(app):
     """Called when webhook server stops"""
     await bot.delete_webhook()
+    await flush_events()
+    await close_http_session()
 
 async def root_handler(request):
     """Check bot status and webhook info"""
@@ -552,7 +805,9 @@ async def root_handler(request):
             f"Render Env Var (WEBHOOK_URL): {env_url}<br>"
             f"Telegram Webhook URL: {webhook_info.url}<br>"
             f"Pending updates: {webhook_info.pending_update_count}<br>"
-            f"Last error: {webhook_info.last_error_message}"
+            f"Last error: {webhook_info.last_error_message}<br>"
+            f"<b>STARTUP TIMINGS:</b><br>{format_timings('<br>')}<br>"
+            f"<b>EXTRACTORS:</b><br>{format_extractor_stats('<br>')}"
         )
         return web.Response(text=info_text, content_type='text/html')
     except Exception as e:
@@ -578,11 +833,17 @@ def run_webhook():
 
 async def run_polling():
     """Run bot in polling mode (for local development)"""
-    if not os.path.exists(DOWNLOAD_PATH): os.makedirs(DOWNLOAD_PATH)
-    await init_db()
+    await prepare_startup()
     await bot.delete_webhook(drop_pending_updates=True)
     print("🤖 Bot ishga tushdi (polling mode)")
-    await dp.start_polling(bot)
+    print(f"⏱ Startup: {format_timings(', ')}")
+    if WARM_UP_IMPORTS:
+        spawn(warm_up_task())
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await flush_events()
+        await close_http_session()
 
 if __name__ == "__main__":
     # Check if running on Render (has PORT env variable)
@@ -596,5 +857,5 @@ if __name__ == "__main__":
             except KeyboardInterrupt:
                 break
             except Exception as e:
-                logging.error(f"Error: {e}")
+                logging.error("Error: %s", e)
                 continue
\ No newline at end of file
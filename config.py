@@ -7,6 +7,52 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x]
 DB_NAME = "bot_database.db"
 
+# Logging: level, and the fraction of DEBUG records kept (overridable per logger,
+# e.g. LOG_SAMPLE_RATES="aiogram.event=0.01,aiohttp=0")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+DEBUG_SAMPLE_RATE = float(os.getenv("DEBUG_SAMPLE_RATE", 0.1))
+LOG_SAMPLE_RATES = {
+    name.strip(): float(rate)
+    for name, rate in (item.split("=", 1) for item in os.getenv("LOG_SAMPLE_RATES", "").split(",") if "=" in item)
+}
+
+# How long a resolved short link is trusted (seconds)
+REDIRECT_CACHE_TTL = int(os.getenv("REDIRECT_CACHE_TTL", 30 * 24 * 60 * 60))
+
+# Telegram Bot API upload limit (bytes); bigger downloads are abandoned early
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+
+# Links longer than this (seconds) are rejected at probe time
+MAX_DURATION = int(os.getenv("MAX_DURATION", 2 * 60 * 60))
+# How long probed link metadata is reused (seconds)
+PROBE_CACHE_TTL = int(os.getenv("PROBE_CACHE_TTL", 600))
+
+# Per-user rate limit: bucket size (tokens) and refill speed (tokens per second)
+RATE_LIMIT_CAPACITY = int(os.getenv("RATE_LIMIT_CAPACITY", 20))
+RATE_LIMIT_REFILL = float(os.getenv("RATE_LIMIT_REFILL", 0.2))
+
+# Download bandwidth controller: total fragment connections across all yt-dlp jobs,
+# per CDN domain, per job, and an optional total rate limit in bytes/s (0 = unlimited).
+# Fast-extractor downloads are not counted; they use the shared aiohttp pool's own limits.
+CONNECTION_BUDGET = int(os.getenv("CONNECTION_BUDGET", 64))
+HOST_CONNECTION_LIMIT = int(os.getenv("HOST_CONNECTION_LIMIT", 24))
+MAX_FRAGMENTS_PER_JOB = int(os.getenv("MAX_FRAGMENTS_PER_JOB", 16))
+BANDWIDTH_LIMIT = int(os.getenv("BANDWIDTH_LIMIT", 0))
+
+# Job queue: retries for transient download errors (exponential backoff, seconds)
+MAX_JOB_ATTEMPTS = int(os.getenv("MAX_JOB_ATTEMPTS", 3))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", 2))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", 60))
+# Interrupted jobs older than this (seconds) are failed instead of resumed
+JOB_RESUME_WINDOW = int(os.getenv("JOB_RESUME_WINDOW", 3600))
+
+# Analytics: how often buffered events are written, and how long raw events are kept
+ANALYTICS_FLUSH_INTERVAL = int(os.getenv("ANALYTICS_FLUSH_INTERVAL", 15))
+ANALYTICS_RETENTION_DAYS = int(os.getenv("ANALYTICS_RETENTION_DAYS", 30))
+
+# Import yt-dlp/shazamio in the background right after startup instead of on the first job
+WARM_UP_IMPORTS = os.getenv("WARM_UP_IMPORTS", "1") == "1"
+
 # Temporary download path
 DOWNLOAD_PATH = "downloads"
 if not os.path.exists(DOWNLOAD_PATH):
@@ -1,5 +1,13 @@
+import logging
+import re
+import time
+import datetime
+from collections import Counter
 import aiosqlite
-from config import DB_NAME
+from config import DB_NAME, ANALYTICS_RETENTION_DAYS, REDIRECT_CACHE_TTL
+
+# Upper bounds (ms) of the latency histogram buckets used by the daily rollups
+LATENCY_BUCKETS = [250, 500, 1000, 2000, 5000, 10000, 20000, 30000, 60000, 120000, 300000]
 
 async def init_db():
     async with aiosqlite.connect(DB_NAME) as db:
@@ -20,6 +28,125 @@ async def init_db():
                 channel_url TEXT
             )
         """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT,
+                payload TEXT,
+                chat_id INTEGER,
+                user_id INTEGER,
+                status_message_id INTEGER,
+                state TEXT DEFAULT 'queued',
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        try:
+            await db.execute("ALTER TABLE jobs ADD COLUMN user_id INTEGER")
+        except:
+            pass # Column likely exists
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state)")
+        # Finished jobs are only needed for a short while
+        await db.execute(
+            "DELETE FROM jobs WHERE state IN ('done', 'failed') AND updated_at < datetime('now', '-1 day')"
+        )
+        
+        # Analytics: raw events are append-only, the daily_* tables are rollups
+        # maintained on every flush so the admin panel never scans events.
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                ts INTEGER,
+                user_id INTEGER,
+                kind TEXT,
+                platform TEXT,
+                ok BOOLEAN,
+                latency_ms INTEGER
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                day TEXT,
+                kind TEXT,
+                platform TEXT,
+                total INTEGER DEFAULT 0,
+                success INTEGER DEFAULT 0,
+                PRIMARY KEY (day, kind, platform)
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS daily_latency (
+                day TEXT,
+                kind TEXT,
+                bucket INTEGER,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (day, kind, bucket)
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS daily_active (
+                day TEXT PRIMARY KEY,
+                users INTEGER DEFAULT 0
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS user_last_seen (
+                user_id INTEGER PRIMARY KEY,
+                day TEXT
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_user_last_seen_day ON user_last_seen (day)")
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER DEFAULT 0
+            )
+        """)
+        # Inline mode: every delivered audio/video, with a full-text index over title/performer
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS media_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_unique_id TEXT UNIQUE,
+                file_id TEXT,
+                kind TEXT,
+                title TEXT,
+                performer TEXT,
+                user_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        try:
+            await db.execute("ALTER TABLE media_cache ADD COLUMN user_id INTEGER")
+        except:
+            pass # Column likely exists
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_media_cache_user ON media_cache (user_id, id)")
+        await db.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5(
+                title, performer,
+                content='media_cache', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        """)
+        await db.execute("""
+            CREATE TRIGGER IF NOT EXISTS media_cache_ai AFTER INSERT ON media_cache BEGIN
+                INSERT INTO media_fts (rowid, title, performer) VALUES (new.id, new.title, new.performer);
+            END
+        """)
+        # Short link -> resolved URL, so each short link is followed over the network only once
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS url_redirects (
+                short_url TEXT PRIMARY KEY,
+                target_url TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await db.execute("DELETE FROM url_redirects WHERE created_at < datetime('now', ?)", (f"-{REDIRECT_CACHE_TTL} seconds",))
+        await db.execute(
+            "DELETE FROM events WHERE ts < ?",
+            (int(time.time()) - ANALYTICS_RETENTION_DAYS * 86400,)
+        )
         
         # Migration: Check if is_admin column exists, if not add it
         try:
@@ -32,24 +159,29 @@ async def init_db():
         except:
             pass
 
+        # Seed the user counter once; add_user keeps it up to date afterwards
+        await db.execute("INSERT OR IGNORE INTO counters (name, value) SELECT 'users', COUNT(*) FROM users")
+
         await db.commit()
 
 async def add_user(telegram_id, full_name, username=None):
     async with aiosqlite.connect(DB_NAME) as db:
         try:
-            await db.execute(
+            cursor = await db.execute(
                 "INSERT OR IGNORE INTO users (telegram_id, full_name, username) VALUES (?, ?, ?)",
                 (telegram_id, full_name, username)
             )
+            if cursor.rowcount:
+                await db.execute("UPDATE counters SET value = value + 1 WHERE name = 'users'")
             # Update username if it changed
             await db.execute("UPDATE users SET username = ? WHERE telegram_id = ?", (username, telegram_id))
             await db.commit()
         except Exception as e:
-            print(f"DB Error: {e}")
+            logging.warning("DB Error: %s", e)
 
 async def get_stats():
     async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT COUNT(*) FROM users") as cursor:
+        async with db.execute("SELECT value FROM counters WHERE name = 'users'") as cursor:
             count = await cursor.fetchone()
             return count[0] if count else 0
 
@@ -85,4 +217,207 @@ async def get_channels():
 async def remove_channel(channel_id):
     async with aiosqlite.connect(DB_NAME) as db:
         await db.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,))
-        await db.commit()
\ No newline at end of file
+        await db.commit()
+
+# --- JOB QUEUE ---
+async def add_job(kind, payload, chat_id, status_message_id, user_id):
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute(
+            "INSERT INTO jobs (kind, payload, chat_id, status_message_id, user_id) VALUES (?, ?, ?, ?, ?)",
+            (kind, payload, chat_id, status_message_id, user_id)
+        )
+        await db.commit()
+        return cursor.lastrowid
+
+async def update_job(job_id, state, attempts, last_error=None):
+    async with aiosqlite.connect(DB_NAME) as db:
+        await db.execute(
+            "UPDATE jobs SET state = ?, attempts = ?, last_error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (state, attempts, last_error, job_id)
+        )
+        await db.commit()
+
+async def get_unfinished_jobs():
+    """Returns (id, kind, payload, chat_id, status_message_id, user_id, attempts, age_seconds) for queued/running jobs."""
+    async with aiosqlite.connect(DB_NAME) as db:
+        async with db.execute(
+            """SELECT id, kind, payload, chat_id, status_message_id, user_id, attempts,
+                      (julianday('now') - julianday(created_at)) * 86400
+               FROM jobs WHERE state IN ('queued', 'running') ORDER BY id"""
+        ) as cursor:
+            return await cursor.fetchall()
+
+# --- URL REDIRECTS ---
+async def get_redirect(short_url, max_age):
+    """Returns the cached target of a short link, or None if unknown or older than `max_age` seconds."""
+    async with aiosqlite.connect(DB_NAME) as db:
+        async with db.execute(
+            "SELECT target_url FROM url_redirects WHERE short_url = ? AND created_at > datetime('now', ?)",
+            (short_url, f"-{int(max_age)} seconds")
+        ) as cursor:
+            res = await cursor.fetchone()
+            return res[0] if res else None
+
+async def save_redirect(short_url, target_url):
+    async with aiosqlite.connect(DB_NAME) as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO url_redirects (short_url, target_url) VALUES (?, ?)",
+            (short_url, target_url)
+        )
+        await db.commit()
+
+# --- MEDIA CACHE (inline mode) ---
+async def add_cached_media(file_unique_id, file_id, kind, title, performer=None, user_id=None):
+    """`user_id` is whoever the file was first delivered to."""
+    async with aiosqlite.connect(DB_NAME) as db:
+        await db.execute(
+            "INSERT OR IGNORE INTO media_cache (file_unique_id, file_id, kind, title, performer, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (file_unique_id, file_id, kind, title, performer, user_id)
+        )
+        await db.commit()
+
+def _fts_query(text):
+    # Every word must match as a prefix; quoting keeps FTS5 syntax characters inert
+    words = re.findall(r'\w+', text.lower())
+    return " ".join(f'"{word}"*' for word in words)
+
+async def search_cached_media(text, user_id=None, offset=0, limit=20):
+    """
+    Returns (id, file_id, kind, title, performer) rows, best match first.
+    An empty query lists only `user_id`'s own deliveries, newest first, never other users' downloads.
+    """
+    query = _fts_query(text)
+    if not query and user_id is None:
+        return []
+    async with aiosqlite.connect(DB_NAME) as db:
+        if query:
+            sql = """SELECT m.id, m.file_id, m.kind, m.title, m.performer
+                     FROM media_fts JOIN media_cache m ON m.id = media_fts.rowid
+                     WHERE media_fts MATCH ? ORDER BY bm25(media_fts) LIMIT ? OFFSET ?"""
+            params = (query, limit, offset)
+        else:
+            sql = "SELECT id, file_id, kind, title, performer FROM media_cache WHERE user_id = ? ORDER BY id DESC LIMIT ? OFFSET ?"
+            params = (user_id, limit, offset)
+        async with db.execute(sql, params) as cursor:
+            return await cursor.fetchall()
+
+# --- ANALYTICS ---
+_event_buffer = []
+
+def track_event(kind, platform, ok, latency, user_id=None):
+    """
+    Buffers one usage event (kind: download/recognition/search/cache_hit, latency in seconds).
+    Nothing touches the DB here; flush_events() writes the buffer in one batch.
+    """
+    _event_buffer.append((int(time.time()), user_id, kind, platform, 1 if ok else 0, int(latency * 1000)))
+
+def latency_bucket(latency_ms):
+    for bound in LATENCY_BUCKETS:
+        if latency_ms <= bound:
+            return bound
+    return LATENCY_BUCKETS[-1] * 10
+
+async def flush_events():
+    """Appends buffered events and folds them into the daily rollups in a single transaction."""
+    global _event_buffer
+    if not _event_buffer:
+        return
+    batch, _event_buffer = _event_buffer, []
+
+    stats = Counter()
+    successes = Counter()
+    latency = Counter()
+    active = {}
+    for ts, user_id, kind, platform, ok, latency_ms in batch:
+        day = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y-%m-%d')
+        stats[(day, kind, platform)] += 1
+        successes[(day, kind, platform)] += ok
+        if kind != 'cache_hit':
+            latency[(day, kind, latency_bucket(latency_ms))] += 1
+        if user_id is not None:
+            active[user_id] = max(day, active.get(user_id, day))
+
+    try:
+        async with aiosqlite.connect(DB_NAME) as db:
+            await db.executemany(
+                "INSERT INTO events (ts, user_id, kind, platform, ok, latency_ms) VALUES (?, ?, ?, ?, ?, ?)",
+                batch
+            )
+            await db.executemany(
+                """INSERT INTO daily_stats (day, kind, platform, total, success) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (day, kind, platform)
+                   DO UPDATE SET total = total + excluded.total, success = success + excluded.success""",
+                [(*key, total, successes[key]) for key, total in stats.items()]
+            )
+            await db.executemany(
+                """INSERT INTO daily_latency (day, kind, bucket, count) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (day, kind, bucket) DO UPDATE SET count = count + excluded.count""",
+                [(*key, count) for key, count in latency.items()]
+            )
+            for user_id, day in active.items():
+                # A user counts towards today's DAU only the first time they are seen today
+                cursor = await db.execute(
+                    """INSERT INTO user_last_seen (user_id, day) VALUES (?, ?)
+                       ON CONFLICT (user_id) DO UPDATE SET day = excluded.day WHERE day < excluded.day""",
+                    (user_id, day)
+                )
+                if cursor.rowcount:
+                    await db.execute(
+                        """INSERT INTO daily_active (day, users) VALUES (?, 1)
+                           ON CONFLICT (day) DO UPDATE SET users = users + 1""",
+                        (day,)
+                    )
+            await db.commit()
+    except Exception as e:
+        logging.warning("Analytics flush error: %s", e)
+
+def _percentile(buckets, fraction):
+    total = sum(count for _, count in buckets)
+    if not total:
+        return None
+    running = 0
+    for bound, count in sorted(buckets):
+        running += count
+        if running >= total * fraction:
+            return bound
+    return buckets[-1][0]
+
+async def get_dashboard(days=7):
+    """
+    Reads the rollups for the admin panel. Every query touches O(days) rollup rows,
+    except MAU which is an index range count on user_last_seen.
+    """
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    since = (today - datetime.timedelta(days=days - 1)).isoformat()
+    month_ago = (today - datetime.timedelta(days=29)).isoformat()
+
+    async with aiosqlite.connect(DB_NAME) as db:
+        async with db.execute("SELECT users FROM daily_active WHERE day = ?", (today.isoformat(),)) as cursor:
+            row = await cursor.fetchone()
+            dau = row[0] if row else 0
+        async with db.execute("SELECT COUNT(*) FROM user_last_seen WHERE day >= ?", (month_ago,)) as cursor:
+            mau = (await cursor.fetchone())[0]
+        async with db.execute(
+            """SELECT platform, SUM(total) FROM daily_stats
+               WHERE day >= ? AND kind = 'download' GROUP BY platform ORDER BY SUM(total) DESC LIMIT 3""",
+            (since,)
+        ) as cursor:
+            top_platforms = await cursor.fetchall()
+        async with db.execute(
+            "SELECT kind, SUM(total), SUM(success) FROM daily_stats WHERE day >= ? GROUP BY kind",
+            (since,)
+        ) as cursor:
+            kinds = {kind: (total, success) for kind, total, success in await cursor.fetchall()}
+        async with db.execute(
+            "SELECT bucket, SUM(count) FROM daily_latency WHERE day >= ? AND kind = 'download' GROUP BY bucket",
+            (since,)
+        ) as cursor:
+            download_latency = await cursor.fetchall()
+
+    return {
+        'dau': dau,
+        'mau': mau,
+        'top_platforms': top_platforms,
+        'kinds': kinds,
+        'p95_download_ms': _percentile(download_latency, 0.95),
+    }
\ No newline at end of file
@@ -0,0 +1,62 @@
+import re
+import random
+import logging
+from logging.handlers import QueueHandler
+
+# Pieces of the logging pipeline wired up in bot.py: handlers only enqueue records;
+# redaction, formatting and I/O run on the QueueListener thread.
+
+class PrivacyFilter(logging.Filter):
+    """Filters out sensitive data from logs (one precompiled pass over the final message)"""
+    PATTERN = re.compile(r'(?P<id>id=\d+)|(?P<token>token=[\w-]+)|(?P<mention>@\w+)|(?P<long_id>\d{9,})')
+    REPLACEMENTS = {
+        'id': 'id=***',
+        'token': 'token=***',
+        'mention': '@***',
+        'long_id': '***ID***',
+    }
+
+    def _replace(self, match):
+        return self.REPLACEMENTS[match.lastgroup]
+
+    def filter(self, record):
+        # getMessage() merges args into msg, so values passed as args are redacted too
+        record.msg = self.PATTERN.sub(self._replace, record.getMessage())
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.PATTERN.sub(self._replace, logging.Formatter().formatException(record.exc_info))
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of DEBUG records, per logger (inherits the nearest configured parent's rate)"""
+
+    def __init__(self, rates, default_rate):
+        super().__init__()
+        self.rates = rates
+        self.default_rate = default_rate
+        self._resolved = {}
+
+    def _rate(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = self.default_rate
+            parts = name.split(".")
+            for i in range(len(parts), 0, -1):
+                prefix = ".".join(parts[:i])
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1 or random.random() < rate
+
+class DeferredQueueHandler(QueueHandler):
+    """Enqueues records as-is; the stock prepare() would format them on the calling thread"""
+
+    def prepare(self, record):
+        return record
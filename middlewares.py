@@ -1,7 +1,115 @@
+import re
+import time
+from collections import OrderedDict
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.enums import ChatMemberStatus
-from database import get_channels
+from config import ADMIN_IDS, RATE_LIMIT_CAPACITY, RATE_LIMIT_REFILL
+from database import get_channels, check_admin
+from services import BARE_HOST_PATTERN
+
+LINK_RE = re.compile(r'https?://|www\.|' + BARE_HOST_PATTERN)
+
+# Token cost per action, roughly proportional to the work it triggers
+ACTION_COSTS = {
+    'command': 1,
+    'callback': 1,
+    'link': 2,        # metadata probe
+    'search': 4,      # YouTube search + MP3 transcode
+    'recognize': 4,   # file download + Shazam + MP3
+    'dl_video': 5,
+    'dl_music': 8,    # download + Shazam + search + MP3
+}
+
+def classify_action(event):
+    if isinstance(event, CallbackQuery):
+        return event.data if event.data in ACTION_COSTS else 'callback'
+    if event.video or event.audio or event.voice or event.video_note:
+        return 'recognize'
+    text = event.text or ''
+    if text.startswith('/'):
+        return 'command'
+    if LINK_RE.search(text):
+        return 'link'
+    if text:
+        return 'search'
+    return 'command'
+
+class RateLimitMiddleware(BaseMiddleware):
+    """
+    Per-user token buckets: each user holds up to `capacity` tokens, refilled at `refill` tokens/sec.
+    Buckets are kept in access order, so idle ones (already refilled to full, i.e. identical
+    to a fresh bucket) are evicted from the front without scanning.
+    A rejected user is told once per cooldown; further rejected updates are dropped silently
+    so a flood of them doesn't turn into a flood of bot messages.
+    """
+
+    def __init__(self, capacity=RATE_LIMIT_CAPACITY, refill=RATE_LIMIT_REFILL):
+        self.capacity = capacity
+        self.refill = refill
+        self.idle_after = capacity / refill
+        self.buckets = OrderedDict()  # user_id -> [tokens, last_update, notified_until]
+
+    def _evict_idle(self, now):
+        while self.buckets:
+            user_id, (_, last, _) = next(iter(self.buckets.items()))
+            if now - last < self.idle_after:
+                break
+            del self.buckets[user_id]
+
+    def consume(self, user_id, cost):
+        """Takes `cost` tokens. Returns 0 on success, otherwise seconds until enough tokens are available."""
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        bucket = self.buckets.pop(user_id, None)
+        if bucket is None:
+            bucket = [self.capacity, now, 0.0]
+        tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill)
+        self.buckets[user_id] = bucket
+
+        if tokens >= cost:
+            bucket[0], bucket[1] = tokens - cost, now
+            return 0
+        bucket[0], bucket[1] = tokens, now
+        return (cost - tokens) / self.refill
+
+    def should_notify(self, user_id, wait):
+        """True for the first rejection of a cooldown window; the window lasts `wait` seconds."""
+        bucket = self.buckets.get(user_id)
+        now = time.monotonic()
+        if bucket is None or now < bucket[2]:
+            return False
+        bucket[2] = now + wait
+        return True
+
+    async def __call__(self, handler, event, data):
+        if not isinstance(event, (Message, CallbackQuery)) or not event.from_user:
+            return await handler(event, data)
+
+        user_id = event.from_user.id
+        if user_id in ADMIN_IDS:
+            return await handler(event, data)
+
+        wait = self.consume(user_id, ACTION_COSTS[classify_action(event)])
+        if not wait:
+            return await handler(event, data)
+
+        # Only hit the DB for admin status when the user is actually over budget
+        if await check_admin(user_id):
+            return await handler(event, data)
+
+        if not self.should_notify(user_id, wait):
+            # Callback queries still need an answer to stop the button's loading spinner
+            if isinstance(event, CallbackQuery):
+                await event.answer()
+            return
+
+        text = f"⏳ Juda ko'p so'rov yuborildi. Iltimos, {int(wait) + 1} soniyadan keyin urinib ko'ring."
+        if isinstance(event, CallbackQuery):
+            await event.answer(text, show_alert=True)
+        else:
+            await event.answer(text)
 
 class ForceSubMiddleware(BaseMiddleware):
     async def __call__(self, handler, event, data):
@@ -1,15 +1,455 @@
 import os
+import logging
+import re
+import json
+import time
 import asyncio
-import yt_dlp
-from shazamio import Shazam
-from config import DOWNLOAD_PATH
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+import aiohttp
+from config import (
+    DOWNLOAD_PATH, MAX_DURATION, PROBE_CACHE_TTL, MAX_UPLOAD_SIZE, REDIRECT_CACHE_TTL,
+    CONNECTION_BUDGET, HOST_CONNECTION_LIMIT, MAX_FRAGMENTS_PER_JOB, BANDWIDTH_LIMIT,
+)
+from database import track_event, get_redirect, save_redirect
 
-# --- DOWNLOADER SERVICE ---
-async def download_media(url: str):
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+# --- LAZY HEAVY IMPORTS ---
+# yt_dlp and shazamio take seconds to import on a cold instance, so they are loaded
+# on first use (or by warm_up() once the webhook is answering), not at bot startup.
+yt_dlp = None
+Shazam = None
+
+def load_yt_dlp():
+    global yt_dlp
+    if yt_dlp is None:
+        import yt_dlp as module
+        yt_dlp = module
+    return yt_dlp
+
+def load_shazam():
+    global Shazam
+    if Shazam is None:
+        from shazamio import Shazam as cls
+        Shazam = cls
+    return Shazam
+
+async def warm_up():
+    """Imports the heavy modules in a worker thread. Returns the time it took (seconds)."""
+    started = time.monotonic()
+    await asyncio.to_thread(load_yt_dlp)
+    await asyncio.to_thread(load_shazam)
+    return time.monotonic() - started
+
+class TransientDownloadError(Exception):
+    """Network-level failure (timeout, 429, 5xx) that is worth retrying later."""
+
+TRANSIENT_MARKERS = (
+    'timed out', 'timeout', 'http error 429', 'too many requests', 'http error 500',
+    'http error 502', 'http error 503', 'http error 504', 'connection reset',
+    'remote end closed', 'temporary failure', 'incomplete read', 'connection aborted',
+)
+
+def is_transient_error(error):
+    message = str(error).lower()
+    return any(marker in message for marker in TRANSIENT_MARKERS)
+
+def reclaim_downloads():
     """
-    Downloads video/audio from different platforms with maximum speed.
-    Returns: (file_path, title, media_type)
+    Removes leftovers in DOWNLOAD_PATH (half-written .part files, merged outputs never sent).
+    Only safe at startup, before any job is running.
+    """
+    for name in os.listdir(DOWNLOAD_PATH):
+        path = os.path.join(DOWNLOAD_PATH, name)
+        if os.path.isfile(path):
+            try: os.remove(path)
+            except: pass
+
+# --- SHARED HTTP SESSION ---
+_http_session = None
+
+async def get_http_session():
     """
+    Returns the shared aiohttp session (pooled connections, keep-alive, DNS cache).
+    Created lazily on first use so it binds to the running event loop.
+    """
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(limit=100, limit_per_host=20, ttl_dns_cache=300, keepalive_timeout=30)
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            headers=BROWSER_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=120, sock_connect=10, sock_read=15),
+        )
+    return _http_session
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+# --- FAST EXTRACTORS ---
+# Lightweight extractors for the hosts that make up most of our traffic.
+# Each one returns {'id', 'title', 'url', 'ext', 'duration', 'thumbnail'} or None;
+# any failure falls back to yt-dlp.
+TIKTOK_DATA_RE = re.compile(r'<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__"[^>]*>(.*?)</script>', re.S)
+OG_VIDEO_RE = re.compile(r'<meta[^>]+property="og:video(?::secure_url)?"[^>]+content="([^"]+)"')
+OG_TITLE_RE = re.compile(r'<meta[^>]+property="og:title"[^>]+content="([^"]*)"')
+OG_IMAGE_RE = re.compile(r'<meta[^>]+property="og:image"[^>]+content="([^"]+)"')
+IG_DURATION_RE = re.compile(r'"video_duration":([\d.]+)')
+IG_VIDEO_URL_RE = re.compile(r'"video_url":("(?:[^"\\]|\\.)*")')
+IG_SHORTCODE_RE = re.compile(r'/(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)')
+IG_EMBED_URL = "https://www.instagram.com/p/{shortcode}/embed/captioned/"
+
+EXTRACTOR_STATS = {}
+
+def _record_extractor(name, ok, elapsed):
+    stats = EXTRACTOR_STATS.setdefault(name, {'attempts': 0, 'success': 0, 'failed': 0, 'total_time': 0.0})
+    stats['attempts'] += 1
+    stats['success' if ok else 'failed'] += 1
+    stats['total_time'] += elapsed
+
+def get_extractor_stats():
+    """Returns {name: {'attempts', 'success', 'failed', 'success_rate', 'avg_latency'}}."""
+    result = {}
+    for name, stats in EXTRACTOR_STATS.items():
+        attempts = stats['attempts'] or 1
+        result[name] = {
+            'attempts': stats['attempts'],
+            'success': stats['success'],
+            'failed': stats['failed'],
+            'success_rate': stats['success'] / attempts,
+            'avg_latency': stats['total_time'] / attempts,
+        }
+    return result
+
+async def extract_tiktok(session, url):
+    async with session.get(url, allow_redirects=True) as resp:
+        if resp.status != 200:
+            return None
+        html = await resp.text()
+
+    match = TIKTOK_DATA_RE.search(html)
+    if not match:
+        return None
+    data = json.loads(match.group(1))
+    detail = data.get('__DEFAULT_SCOPE__', {}).get('webapp.video-detail', {})
+    item = detail.get('itemInfo', {}).get('itemStruct')
+    if not item:
+        # Removed/private items and login walls carry a statusCode but no itemInfo
+        return None
+    video = item.get('video') or {}
+    media_url = video.get('playAddr') or video.get('downloadAddr')
+    if not media_url:
+        return None
+    return {
+        'id': item['id'],
+        'title': item.get('desc') or 'Media',
+        'url': media_url,
+        'ext': 'mp4',
+        'duration': video.get('duration'),
+        'thumbnail': video.get('cover'),
+    }
+
+async def extract_instagram(session, url):
+    match = IG_SHORTCODE_RE.search(urlparse(url).path)
+    if not match:
+        return None
+    shortcode = match.group(1)
+
+    async with session.get(IG_EMBED_URL.format(shortcode=shortcode)) as resp:
+        if resp.status != 200:
+            return None
+        html = await resp.text()
+
+    media_url = None
+    og = OG_VIDEO_RE.search(html)
+    if og:
+        media_url = og.group(1).replace('&amp;', '&')
+    else:
+        raw = IG_VIDEO_URL_RE.search(html)
+        if raw:
+            media_url = json.loads(raw.group(1))
+    if not media_url:
+        return None
+
+    title = OG_TITLE_RE.search(html)
+    duration = IG_DURATION_RE.search(html)
+    thumbnail = OG_IMAGE_RE.search(html)
+    return {
+        'id': shortcode,
+        'title': title.group(1) if title else 'Media',
+        'url': media_url,
+        'ext': 'mp4',
+        'duration': float(duration.group(1)) if duration else None,
+        'thumbnail': thumbnail.group(1).replace('&amp;', '&') if thumbnail else None,
+    }
+
+# Routed by host suffix, so short links (vm.tiktok.com) hit the same extractor.
+FAST_EXTRACTORS = {
+    'tiktok.com': ('tiktok', extract_tiktok),
+    'instagram.com': ('instagram', extract_instagram),
+}
+
+PLATFORMS = {
+    'tiktok.com': 'tiktok',
+    'instagram.com': 'instagram',
+    'youtube.com': 'youtube',
+    'youtu.be': 'youtube',
+    'facebook.com': 'facebook',
+    'fb.watch': 'facebook',
+}
+
+def platform_of(url):
+    """Short platform label for analytics, by host suffix."""
+    host = (urlparse(url if '://' in url else 'https://' + url).hostname or '').lower()
+    for suffix, platform in PLATFORMS.items():
+        if host == suffix or host.endswith('.' + suffix):
+            return platform
+    return 'other'
+
+def get_fast_extractor(url):
+    host = (urlparse(url).hostname or '').lower()
+    for suffix, extractor in FAST_EXTRACTORS.items():
+        if host == suffix or host.endswith('.' + suffix):
+            return extractor
+    return None
+
+async def _fetch_to_file(session, media_url, file_path, referer):
+    """
+    Streams the media to disk; file writes run in a worker thread.
+    Gives up (returns False) once the file would exceed MAX_UPLOAD_SIZE, since Telegram won't take it.
+    """
+    async with session.get(media_url, headers={'Referer': referer}) as resp:
+        if resp.status != 200:
+            return False
+        if (resp.content_length or 0) > MAX_UPLOAD_SIZE:
+            return False
+        f = await asyncio.to_thread(open, file_path, 'wb')
+        try:
+            written = 0
+            async for chunk in resp.content.iter_chunked(256 * 1024):
+                written += len(chunk)
+                if written > MAX_UPLOAD_SIZE:
+                    return False
+                await asyncio.to_thread(f.write, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+    return written > 0
+
+async def fast_probe(url: str):
+    """Metadata-only run of the lightweight extractor for this host. Returns its info dict or None."""
+    extractor = get_fast_extractor(url)
+    if not extractor:
+        return None
+    name, extract = extractor
+    try:
+        session = await get_http_session()
+        info = await extract(session, url)
+    except Exception as e:
+        logging.warning("%s probe error: %s", name, e)
+        return None
+    if info:
+        info['fast'] = name
+    return info
+
+async def fast_download(url: str, info=None):
+    """
+    Tries the lightweight extractor for this host; `info` from fast_probe() skips the page fetch.
+    Returns: (file_path, title, media_type) or None when yt-dlp should take over.
+    """
+    extractor = get_fast_extractor(url)
+    if not extractor:
+        return None
+    name, extract = extractor
+
+    started = time.monotonic()
+    file_path = None
+    try:
+        session = await get_http_session()
+        if info is None:
+            info = await extract(session, url)
+        if info:
+            file_path = f"{DOWNLOAD_PATH}/{info['id']}.{info['ext']}"
+            if await _fetch_to_file(session, info['url'], file_path, url):
+                _record_extractor(name, True, time.monotonic() - started)
+                return file_path, info['title'], 'video'
+    except Exception as e:
+        logging.warning("%s extractor error: %s", name, e)
+
+    _record_extractor(name, False, time.monotonic() - started)
+    if file_path and os.path.exists(file_path):
+        try: os.remove(file_path)
+        except: pass
+    return None
+
+# --- URL CANONICALIZATION ---
+# Different links to the same media (short links, share links, tracking params)
+# are reduced to one canonical URL and a (platform, media_id) key for every cache.
+# Links pasted without a scheme, e.g. "instagram.com/reel/ABC/?igsh=..."
+BARE_HOST_PATTERN = r'(?<![\w@./-])(?:[\w-]+\.)*(?:tiktok\.com|instagram\.com|youtube\.com|youtu\.be|facebook\.com|fb\.watch)/'
+URL_RE = re.compile(r'(?:https?://|www\.|' + BARE_HOST_PATTERN + r')[^\s<>"]+')
+# Messages the link handler reacts to
+LINK_PATTERN = (
+    r'(https?://(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|www\.[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}'
+    r'|https?://(?:www\.|(?!www))[a-zA-Z0-9]+\.[^\s]{2,}|' + BARE_HOST_PATTERN + r'[^\s]+)'
+)
+TRACKING_PARAMS = {
+    'igsh', 'igshid', 'is_from_webapp', 'sender_device', 'sender_web_id', 'share_app_id', 'share_link_id',
+    'si', 'feature', 'fbclid', 'gclid', 'ref', 'ref_src', 'mibextid', 'rdid', '_r', '_t', 'pp', 'is_copy_url',
+}
+# Query strings on these platforms never identify the media
+QUERYLESS_PLATFORMS = {'tiktok', 'instagram'}
+SHORT_LINK_HOSTS = {'vm.tiktok.com', 'vt.tiktok.com', 'fb.watch', 'pin.it'}
+SHORT_LINK_PATHS = (('tiktok.com', '/t/'), ('instagram.com', '/share/'), ('facebook.com', '/share/'))
+MEDIA_ID_PATTERNS = {
+    'tiktok': re.compile(r'/(?:video|photo)/(\d+)'),
+    'instagram': re.compile(r'/(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)'),
+    'youtube': re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/live/|/embed/)([A-Za-z0-9_-]{11})'),
+    'facebook': re.compile(r'(?:/videos/(?:[^/]+/)?|/reel/|[?&]v=)(\d+)'),
+}
+
+def normalize_url(url: str):
+    """Lowercases scheme/host, drops the fragment and trailing slash so equal links share one cache entry."""
+    url = url.strip()
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    parsed = urlparse(url)
+    path = parsed.path.rstrip('/') or '/'
+    normalized = f"https://{(parsed.hostname or '').lower()}{path}"
+    if parsed.query:
+        normalized += f"?{parsed.query}"
+    return normalized
+
+def extract_url(text: str):
+    """Returns the first URL in a message (surrounding words and trailing punctuation removed) or None."""
+    match = URL_RE.search(text or '')
+    return match.group(0).rstrip('.,!?;:)]}\'"') if match else None
+
+def strip_tracking(url: str):
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    parsed = urlparse(url)._replace(fragment='')
+    if not parsed.query or platform_of(url) in QUERYLESS_PLATFORMS:
+        return urlunparse(parsed._replace(query=''))
+    params = [
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if key not in TRACKING_PARAMS and not key.startswith('utm_')
+    ]
+    return urlunparse(parsed._replace(query=urlencode(params)))
+
+def is_short_link(url: str):
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    if host in SHORT_LINK_HOSTS:
+        return True
+    return any(
+        (host == suffix or host.endswith('.' + suffix)) and parsed.path.startswith(prefix)
+        for suffix, prefix in SHORT_LINK_PATHS
+    )
+
+def identify_media(url: str):
+    """Returns (platform, media_id); media_id is None when the URL doesn't carry a known id."""
+    platform = platform_of(url)
+    pattern = MEDIA_ID_PATTERNS.get(platform)
+    match = pattern.search(url) if pattern else None
+    return platform, match.group(1) if match else None
+
+def media_key(url: str):
+    """Stable cache/dedup key: 'platform:media_id' when known, otherwise the normalized URL."""
+    platform, media_id = identify_media(url)
+    return f"{platform}:{media_id}" if media_id else normalize_url(url)
+
+async def resolve_short_link(url: str):
+    """
+    Follows a short link's redirects. Only a successful redirect to an identifiable media page
+    is kept in url_redirects (login walls and home pages are not); otherwise `url` is returned.
+    """
+    cached = await get_redirect(url, REDIRECT_CACHE_TTL)
+    if cached:
+        return cached
+    try:
+        session = await get_http_session()
+        async with session.get(url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+            status = resp.status
+            target = strip_tracking(str(resp.url))
+    except Exception as e:
+        logging.warning("Redirect resolve error: %s", e)
+        return url
+    if not 200 <= status < 300 or identify_media(target)[1] is None:
+        return url
+    await save_redirect(url, target)
+    return target
+
+async def canonicalize_url(text: str):
+    """
+    Extracts the URL from `text`, resolves short links and strips tracking parameters.
+    Returns the canonical URL, or None if the text has no URL.
+    """
+    url = extract_url(text)
+    if not url:
+        return None
+    url = strip_tracking(url)
+    if is_short_link(url):
+        url = await resolve_short_link(url)
+    return url
+
+# --- PROBE CACHE ---
+class TTLCache:
+    """Small LRU dict whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        item = self._data.pop(key, None)
+        return item[1] if item else None
+
+# Media URLs inside the info dict are signed and expire, so keep the TTL short.
+# Entries are either fast-extractor infos (marked with 'fast') or trimmed yt-dlp infos.
+probe_cache = TTLCache(ttl=PROBE_CACHE_TTL, maxsize=128)
+
+# Large parts of a yt-dlp info dict that neither process_ie_result nor probe_summary need
+PROBE_DROP_KEYS = (
+    'automatic_captions', 'subtitles', 'requested_subtitles', 'thumbnails', 'heatmap',
+    'chapters', 'description', 'comments', 'tags', 'categories', 'requested_downloads',
+)
+
+def trim_probe(info):
+    """Keeps only the selected formats and drops captions/thumbnails so a cached probe stays small."""
+    selected = {f.get('format_id') for f in (info.get('requested_formats') or [info])}
+    trimmed = {key: value for key, value in info.items() if key not in PROBE_DROP_KEYS}
+    if info.get('formats'):
+        trimmed['formats'] = [f for f in info['formats'] if f.get('format_id') in selected]
+    return trimmed
+
+def media_opts():
+    """yt-dlp options shared by the probe and the video download."""
     ydl_opts = {
         # Highest quality with speed optimizations
         'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best',
@@ -20,17 +460,12 @@ async def download_media(url: str):
         'geo_bypass': True,
         'merge_output_format': 'mp4',
         
-        # Maximum speed settings
-        'concurrent_fragment_downloads': 16,
-        'buffersize': 16384,
+        # Speed settings (fragment concurrency and buffer size come from the bandwidth controller)
         'retries': 5,
         'socket_timeout': 15,
         
         # Platform compatibility
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept-Language': 'en-US,en;q=0.9',
-        },
+        'http_headers': dict(BROWSER_HEADERS),
         
         # TikTok/Facebook/Instagram specific
         'extractor_args': {
@@ -42,36 +477,393 @@ async def download_media(url: str):
     
     if os.path.exists("cookies.txt"):
         ydl_opts['cookiefile'] = "cookies.txt"
+    return ydl_opts
+
+def probe_summary(info):
+    """Extracts the fields the bot shows/checks: id, title, duration, filesize, thumbnail, live."""
+    formats = info.get('requested_formats') or [info]
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in formats]
+    return {
+        'id': info.get('id'),
+        'title': info.get('title') or 'Media',
+        'duration': info.get('duration'),
+        'filesize': sum(sizes) if all(sizes) else None,
+        'thumbnail': info.get('thumbnail'),
+        'is_live': info.get('is_live') or info.get('live_status') in ('is_live', 'is_upcoming'),
+    }
+
+async def probe_media(url: str):
+    """
+    Runs metadata extraction only (no download) and caches the result by media key.
+    Hosts with a fast extractor are probed with it; yt-dlp only runs when that fails.
+    Returns: (summary, error) - summary is None when the link can't be served,
+    error is 'unavailable', 'live', 'too_long' or None.
+    """
+    key = media_key(url)
+    cached = probe_cache.get(key)
+    if cached:
+        track_event('cache_hit', platform_of(url), True, 0)
+        return probe_summary(cached), None
+
+    info = await fast_probe(url)
+    if info:
+        return _check_probe(key, info)
+
+    def run_probe():
+        with load_yt_dlp().YoutubeDL(media_opts()) as ydl:
+            return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+    try:
+        info = await asyncio.to_thread(run_probe)
+    except Exception as e:
+        message = str(e).lower()
+        if 'private' in message or 'unavailable' in message or 'removed' in message:
+            return None, 'unavailable'
+        # Unknown failures are not conclusive; the download path still gets its chance.
+        logging.warning("Probe error: %s", e)
+        return None, None
+
+    return _check_probe(key, trim_probe(info))
+
+def _check_probe(key, info):
+    summary = probe_summary(info)
+    if summary['is_live']:
+        return None, 'live'
+    if summary['duration'] and summary['duration'] > MAX_DURATION:
+        return None, 'too_long'
+
+    probe_cache.set(key, info)
+    return summary, None
+
+def _media_type(filename, info):
+    ext = info.get('ext', '') or ''
+    if not ext:
+        _, ext = os.path.splitext(filename)
+        ext = ext.replace('.', '')
+    
+    if ext in ['jpg', 'jpeg', 'png', 'webp']:
+        return 'image'
+    elif ext in ['mp3', 'm4a', 'wav', 'opus']:
+        return 'audio'
+    return 'video'
+
+# --- BANDWIDTH CONTROLLER ---
+# Two-part public suffixes, so "a.b.co.uk" is keyed as "b.co.uk" rather than "co.uk"
+MULTI_PART_SUFFIXES = {'co.uk', 'org.uk', 'com.au', 'net.au', 'co.jp', 'co.kr', 'co.in', 'com.br', 'com.tr', 'com.cn', 'com.mx'}
+# Page domains whose media is served from a separate CDN domain
+CDN_DOMAINS = {
+    'youtube.com': 'googlevideo.com',
+    'youtu.be': 'googlevideo.com',
+    'instagram.com': 'cdninstagram.com',
+    'facebook.com': 'fbcdn.net',
+    'fb.watch': 'fbcdn.net',
+    'tiktok.com': 'tiktokcdn.com',
+}
+
+def registrable_domain(host):
+    """"rr3---sn-abc.googlevideo.com" -> "googlevideo.com"; IP addresses are returned unchanged."""
+    host = (host or '').lower().rstrip('.')
+    if not host or host.replace('.', '').isdigit() or ':' in host:
+        return host
+    labels = host.split('.')
+    size = 3 if '.'.join(labels[-2:]) in MULTI_PART_SUFFIXES else 2
+    return '.'.join(labels[-size:])
+
+FRAGMENTED_PROTOCOLS = ('m3u8', 'http_dash_segments', 'dash', 'ism', 'f4m')
+
+def is_fragmented(info):
+    """True when any selected format is downloaded in fragments (HLS/DASH), i.e. can use several connections."""
+    formats = info.get('requested_formats') or [info]
+    return any(
+        f.get('fragments') or (f.get('protocol') or '').startswith(FRAGMENTED_PROTOCOLS)
+        for f in formats
+    )
+
+class BandwidthController:
+    """
+    Keeps yt-dlp fragment connections within a global budget and a per-host limit.
+    A job's fragment concurrency is fixed when it starts, so a fragmented job only gets what
+    running jobs have left, and at most a third of its host's limit so the next jobs aren't
+    queued behind it; when nothing is left it waits in acquire() on the event loop.
+    A single-connection download (most audio-only formats) is charged one slot and never waits:
+    it adds one connection, like the fast path, but leaves that much less for fragmented jobs.
+    Hosts are keyed by registrable domain so all nodes of one CDN share a limit. Each recent
+    throttle (429/timeouts) halves the host's limit per level; levels decay after a quiet period.
+    Only yt-dlp downloads are counted: the fast extractors fetch over the shared aiohttp session,
+    one connection per file, capped by its own connector limits.
+    Slots are returned when the last file of a job is downloaded, before merging/FFmpeg.
+    Progress hooks and release() run in yt-dlp worker threads, hence the lock.
+    """
+    MAX_PENALTY = 4
+    PENALTY_DECAY = 30
+    HOST_IDLE_TTL = 600
+    HOST_SHARE = 3
+    MIN_BUFFER = 16 * 1024
+    MAX_BUFFER = 1024 * 1024
+
+    def __init__(self, connection_budget, host_connection_limit, max_fragments, bandwidth_limit=0):
+        self.connection_budget = connection_budget
+        self.host_connection_limit = host_connection_limit
+        self.max_fragments = max_fragments
+        self.bandwidth_limit = bandwidth_limit
+        self.active_jobs = 0
+        self.waiting_jobs = 0
+        self.held = 0
+        self.hosts = {}
+        self._waiters = []  # (loop, future) of jobs blocked in acquire()
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = {
+                'active': 0, 'held': 0, 'throughput': 0.0, 'penalty': 0, 'penalty_until': 0.0, 'last_used': 0.0,
+            }
+        now = time.monotonic()
+        while state['penalty'] and state['penalty_until'] < now:
+            state['penalty'] -= 1
+            state['penalty_until'] += self.PENALTY_DECAY
+        state['last_used'] = now
+        return state
+
+    def _prune(self):
+        now = time.monotonic()
+        for host, state in list(self.hosts.items()):
+            if (not state['active'] and not state['penalty']
+                    and now - state['last_used'] > self.HOST_IDLE_TTL):
+                del self.hosts[host]
+
+    def _host_limit(self, state):
+        return max(1, self.host_connection_limit >> state['penalty'])
+
+    def try_acquire(self, host, fragmented=True):
+        """
+        Registers a job and returns its {'fragments', 'buffersize', 'ratelimit'} allocation (plus the
+        host and penalty it was made under), or None when a fragmented job has to wait for room.
+        """
+        with self._lock:
+            return self._allocate(registrable_domain(host), fragmented)
+
+    async def acquire(self, host, fragmented=True):
+        """Like try_acquire(), but waits (on the event loop, not in a thread) until the job fits."""
+        host = registrable_domain(host)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                allocation = self._allocate(host, fragmented)
+                if allocation:
+                    return allocation
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+                self.waiting_jobs += 1
+            try:
+                await waiter
+            finally:
+                with self._lock:
+                    self.waiting_jobs -= 1
+                    if (loop, waiter) in self._waiters:
+                        self._waiters.remove((loop, waiter))
+
+    def _allocate(self, host, fragmented):
+        state = self._host(host)
+        if fragmented:
+            room = min(self.connection_budget - self.held, self._host_limit(state) - state['held'])
+            if room < 1:
+                return None
+            # Jobs still queued count towards the fair share, so a backlog spreads the budget thinner
+            share = min(
+                self.max_fragments,
+                self._host_limit(state) // self.HOST_SHARE,
+                self.connection_budget // (self.active_jobs + 1 + self.waiting_jobs),
+            )
+            fragments = max(1, min(share, room))
+        else:
+            fragments = 1
 
-    def run_yt_dlp():
+        self.active_jobs += 1
+        self.held += fragments
+        state['active'] += 1
+        state['held'] += fragments
+
+        # Fast hosts get bigger reads per fragment; unknown hosts start at the minimum
+        per_fragment = state['throughput'] / fragments if state['throughput'] else 0
+        buffersize = int(min(self.MAX_BUFFER, max(self.MIN_BUFFER, per_fragment / 8)))
+
+        # Proportional to connections held, so running jobs never sum past the limit
+        ratelimit = self.bandwidth_limit * fragments // self.connection_budget if self.bandwidth_limit else None
+        return {
+            'host': host, 'penalty': state['penalty'], 'released': False,
+            'fragments': fragments, 'buffersize': buffersize, 'ratelimit': ratelimit,
+        }
+
+    def release(self, allocation):
+        """Returns the allocation's slots; safe to call more than once."""
+        with self._lock:
+            if allocation['released']:
+                return
+            allocation['released'] = True
+            state = self._host(allocation['host'])
+            self.active_jobs = max(0, self.active_jobs - 1)
+            self.held = max(0, self.held - allocation['fragments'])
+            state['active'] = max(0, state['active'] - 1)
+            state['held'] = max(0, state['held'] - allocation['fragments'])
+            self._prune()
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def record_throughput(self, host, speed):
+        with self._lock:
+            state = self._host(registrable_domain(host))
+            # Exponentially weighted, so one slow/fast sample doesn't swing the allocation
+            state['throughput'] = speed if not state['throughput'] else 0.8 * state['throughput'] + 0.2 * speed
+
+    def record_throttle(self, allocation):
+        """
+        Backs off the allocation's host. Only jobs started under the current penalty raise it further;
+        jobs that started with the older, higher limit can't tell whether the lower one is enough.
+        """
+        with self._lock:
+            state = self._host(allocation['host'])
+            if allocation['penalty'] >= state['penalty']:
+                state['penalty'] = min(self.MAX_PENALTY, state['penalty'] + 1)
+            state['penalty_until'] = time.monotonic() + self.PENALTY_DECAY * 2 ** state['penalty']
+
+    def progress_hook(self, allocation, downloads):
+        """Records throughput and releases the allocation once all `downloads` files are finished."""
+        finished = 0
+
+        def hook(progress):
+            nonlocal finished
+            if progress.get('status') == 'downloading' and progress.get('speed'):
+                self.record_throughput(allocation['host'], progress['speed'])
+            elif progress.get('status') == 'finished':
+                finished += 1
+                if finished >= downloads:
+                    self.release(allocation)
+        return hook
+
+    def apply(self, ydl_opts, allocation, info):
+        """Fills yt-dlp options for downloading `info` under `allocation`; release() it when the job ends."""
+        ydl_opts['concurrent_fragment_downloads'] = allocation['fragments']
+        ydl_opts['buffersize'] = allocation['buffersize']
+        if allocation['ratelimit']:
+            ydl_opts['ratelimit'] = allocation['ratelimit']
+        downloads = len(info.get('requested_formats') or [info])
+        ydl_opts['progress_hooks'] = [self.progress_hook(allocation, downloads)]
+        return ydl_opts
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+bandwidth = BandwidthController(
+    connection_budget=CONNECTION_BUDGET,
+    host_connection_limit=HOST_CONNECTION_LIMIT,
+    max_fragments=MAX_FRAGMENTS_PER_JOB,
+    bandwidth_limit=BANDWIDTH_LIMIT,
+)
+
+THROTTLE_MARKERS = ('http error 429', 'too many requests', 'timed out', 'timeout')
+
+def is_throttle_error(error):
+    message = str(error).lower()
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+def download_host(url, info=None):
+    """
+    Domain that actually serves the bytes: the CDN from probed formats when known,
+    else the page's usual CDN, else the page domain.
+    """
+    if info:
+        formats = info.get('requested_formats') or [info]
+        media_url = formats[0].get('url')
+        if media_url:
+            return registrable_domain(urlparse(media_url).hostname)
+    domain = registrable_domain(urlparse(url).hostname)
+    return CDN_DOMAINS.get(domain, domain)
+
+# --- DOWNLOADER SERVICE ---
+async def download_media(url: str):
+    """
+    Downloads video/audio from different platforms with maximum speed.
+    A cached probe is reused as-is (no second extraction): fast-extractor probes go straight
+    to the media fetch, yt-dlp probes to process_ie_result. Without one, TikTok/Instagram
+    go through the fast extractors first, everything else (and any failure) through yt-dlp.
+    Returns: (file_path, title, media_type)
+    """
+    key = media_key(url)
+    probed = probe_cache.get(key)
+
+    if probed and probed.get('fast'):
+        result = await fast_download(url, probed)
+        if result:
+            return result
+        # The cached media URL may have expired; start over without it
+        probe_cache.pop(key)
+        probed = None
+
+    if not probed:
+        result = await fast_download(url)
+        if result:
+            return result
+
+    reused = probed is not None
+
+    def extract():
+        try:
+            with load_yt_dlp().YoutubeDL(media_opts()) as ydl:
+                return ydl.sanitize_info(ydl.extract_info(url, download=False))
+        except Exception as e:
+            logging.warning("yt-dlp error: %s", e)
+            if is_transient_error(e):
+                raise TransientDownloadError(str(e)) from e
+            return None
+
+    def run_yt_dlp(info, allocation):
+        ydl_opts = bandwidth.apply(media_opts(), allocation, info)
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+            with load_yt_dlp().YoutubeDL(ydl_opts) as ydl:
+                try:
+                    info = ydl.process_ie_result(dict(info), download=True)
+                except Exception as e:
+                    if not reused:
+                        raise
+                    # Signed media URLs may have expired; fall back to a fresh extraction
+                    logging.warning("Probe reuse failed: %s", e)
+                    probe_cache.pop(key)
+                    info = ydl.extract_info(url, download=True)
                 filename = ydl.prepare_filename(info)
                 title = info.get('title', 'Media') or 'Media'
-                ext = info.get('ext', '') or ''
-                
-                if not ext:
-                    _, ext = os.path.splitext(filename)
-                    ext = ext.replace('.', '')
-                
-                if ext in ['jpg', 'jpeg', 'png', 'webp']:
-                    media_type = 'image'
-                elif ext in ['mp3', 'm4a', 'wav', 'opus']:
-                    media_type = 'audio'
-                else:
-                    media_type = 'video'
-                    
-                return filename, title, media_type
+                return filename, title, _media_type(filename, info)
         except Exception as e:
-            print(f"yt-dlp error: {e}")
+            logging.warning("yt-dlp error: %s", e)
+            if is_throttle_error(e):
+                bandwidth.record_throttle(allocation)
+            if is_transient_error(e):
+                raise TransientDownloadError(str(e)) from e
             return None, None, None
+        finally:
+            bandwidth.release(allocation)
 
+    # Formats are chosen before any slot is taken, so the allocation fits them
+    # and waiting for one happens here on the loop, not in an executor thread
+    started = time.monotonic()
     try:
-        return await asyncio.to_thread(run_yt_dlp)
+        info = probed or await asyncio.to_thread(extract)
+        if info:
+            allocation = await bandwidth.acquire(download_host(url, info), is_fragmented(info))
+            result = await asyncio.to_thread(run_yt_dlp, info, allocation)
+        else:
+            result = None, None, None
+    except TransientDownloadError:
+        _record_extractor('yt-dlp', False, time.monotonic() - started)
+        raise
     except Exception as e:
-        print(f"Async Download Error: {e}")
-        return None, None, None
+        logging.warning("Async Download Error: %s", e)
+        result = None, None, None
+    _record_extractor('yt-dlp', result[0] is not None, time.monotonic() - started)
+    return result
 
 async def search_and_download_song(query: str):
     """
@@ -91,26 +883,48 @@ async def search_and_download_song(query: str):
         'noplaylist': True,
         'geo_bypass': True,
         'socket_timeout': 10,
-        'concurrent_fragment_downloads': 8,
     }
 
     def run_search():
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(f"ytsearch1:{query}", download=True)
+            with load_yt_dlp().YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(f"ytsearch1:{query}", download=False)
                 if 'entries' in info:
                     info = info['entries'][0]
-                
+                return ydl.sanitize_info(info)
+        except Exception as e:
+            if is_transient_error(e):
+                raise TransientDownloadError(str(e)) from e
+            return None
+
+    def run_download(info, allocation):
+        # The MP3 conversion runs after the progress hook has returned the slots
+        opts = bandwidth.apply(dict(ydl_opts), allocation, info)
+        try:
+            with load_yt_dlp().YoutubeDL(opts) as ydl:
+                info = ydl.process_ie_result(dict(info), download=True)
                 filename = ydl.prepare_filename(info)
                 base, _ = os.path.splitext(filename)
                 final_filename = base + ".mp3"
                 
                 return final_filename, info
-        except Exception:
+        except Exception as e:
+            if is_throttle_error(e):
+                bandwidth.record_throttle(allocation)
+            if is_transient_error(e):
+                raise TransientDownloadError(str(e)) from e
             return None, None
+        finally:
+            bandwidth.release(allocation)
 
     try:
-        return await asyncio.to_thread(run_search)
+        info = await asyncio.to_thread(run_search)
+        if not info:
+            return None, None
+        allocation = await bandwidth.acquire(download_host('https://www.youtube.com/', info), is_fragmented(info))
+        return await asyncio.to_thread(run_download, info, allocation)
+    except TransientDownloadError:
+        raise
     except Exception:
         return None, None
 
@@ -121,7 +935,7 @@ async def recognize_music(file_path: str):
     Tries multiple times and uses audio normalization for better results.
     """
     try:
-        shazam = Shazam()
+        shazam = (await asyncio.to_thread(load_shazam))()
         
         # Try recognition directly first
         out = await shazam.recognize(file_path)
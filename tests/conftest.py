@@ -0,0 +1,7 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# bot.py builds its Bot at import time, which needs a well-formed token
+os.environ.setdefault("BOT_TOKEN", "123456:TEST-TOKEN")
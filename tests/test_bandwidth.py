@@ -0,0 +1,203 @@
+"""
+BandwidthController allocation: global budget, per-host limit, throttle backoff, host keying.
+"""
+import asyncio
+
+import services
+from services import BandwidthController, registrable_domain
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_jobs_on_one_host_stay_within_host_limit():
+    controller = BandwidthController(64, 24, 16)
+    allocations = [controller.try_acquire(f"rr{i}---sn-a.googlevideo.com") for i in range(3)]
+    # No single job takes most of the host's limit
+    assert [a["fragments"] for a in allocations] == [8, 8, 8]
+    # The host is full: the next fragmented job has to wait instead of opening more connections
+    assert controller.try_acquire("rr2---sn-c.googlevideo.com") is None
+    assert controller.hosts["googlevideo.com"]["held"] == 24
+
+
+def test_jobs_across_hosts_stay_within_budget():
+    controller = BandwidthController(64, 24, 16)
+    allocations = [controller.try_acquire(f"cdn{i}.example{i}.com") for i in range(8)]
+    assert controller.held == 64
+    assert controller.try_acquire("cdn.other.net") is None
+
+    async def scenario():
+        waiting = asyncio.create_task(controller.acquire("cdn.other.net"))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        # Released from a worker thread, as yt-dlp's progress hook does
+        await asyncio.to_thread(controller.release, allocations.pop())
+        return await asyncio.wait_for(waiting, 1)
+
+    allocation = run(scenario())
+    assert allocation["fragments"] <= 8
+    assert controller.held <= 64
+    for allocation in allocations + [allocation]:
+        controller.release(allocation)
+    assert controller.held == 0
+
+
+def test_many_concurrent_jobs_never_exceed_budget():
+    controller = BandwidthController(64, 24, 16)
+    peak = []
+
+    async def job(i):
+        allocation = await controller.acquire(f"node{i}.cdn{i % 5}.com")
+        peak.append(controller.held)
+        assert all(state["held"] <= 24 for state in controller.hosts.values())
+        await asyncio.sleep(0.01)
+        controller.release(allocation)
+
+    async def scenario():
+        await asyncio.wait_for(asyncio.gather(*(job(i) for i in range(40))), 5)
+
+    run(scenario())
+    assert len(peak) == 40
+    assert max(peak) <= 64
+    assert controller.held == 0 and controller.waiting_jobs == 0
+
+
+def test_single_connection_jobs_are_always_admitted():
+    controller = BandwidthController(64, 24, 16)
+    for i in range(3):
+        controller.try_acquire("rr1---sn-a.googlevideo.com")
+
+    async def scenario():
+        jobs = [controller.acquire("rr5---sn-b.googlevideo.com", fragmented=False) for _ in range(30)]
+        return await asyncio.wait_for(asyncio.gather(*jobs), 1)
+
+    allocations = run(scenario())
+    assert [a["fragments"] for a in allocations] == [1] * 30
+    # They count, so a fragmented job still waits for room
+    assert controller.try_acquire("rr1---sn-a.googlevideo.com") is None
+
+
+def test_release_is_idempotent():
+    controller = BandwidthController(64, 24, 16)
+    allocation = controller.try_acquire("a.example.com")
+    controller.release(allocation)
+    controller.release(allocation)
+    assert controller.held == 0 and controller.active_jobs == 0
+
+
+class FakeSearchYoutubeDL:
+    held_after_download = []
+
+    def __init__(self, opts):
+        self.opts = opts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=True):
+        assert not download
+        return {"entries": [{
+            "id": url, "title": "Song", "ext": "m4a", "protocol": "https",
+            "url": "https://rr4---sn-abc.googlevideo.com/videoplayback?itag=140",
+        }]}
+
+    @staticmethod
+    def sanitize_info(info):
+        return info
+
+    def process_ie_result(self, info, download=True):
+        for hook in self.opts["progress_hooks"]:
+            hook({"status": "finished"})
+        # The MP3 conversion would run here, after the slot went back
+        FakeSearchYoutubeDL.held_after_download.append(services.bandwidth.hosts["googlevideo.com"]["held"])
+        return info
+
+    def prepare_filename(self, info):
+        return f"{services.DOWNLOAD_PATH}/{info['id']}.m4a"
+
+
+class FakeSearchModule:
+    YoutubeDL = FakeSearchYoutubeDL
+
+
+def test_concurrent_searches_are_all_admitted(monkeypatch):
+    controller = BandwidthController(64, 24, 16)
+    monkeypatch.setattr(services, "bandwidth", controller)
+    monkeypatch.setattr(services, "load_yt_dlp", lambda: FakeSearchModule)
+    FakeSearchYoutubeDL.held_after_download = []
+    # YouTube's CDN is already full of fragmented video jobs
+    busy = [controller.try_acquire("rr1---sn-a.googlevideo.com") for _ in range(3)]
+
+    async def scenario():
+        searches = [services.search_and_download_song(f"song {i}") for i in range(20)]
+        return await asyncio.wait_for(asyncio.gather(*searches), 5)
+
+    results = run(scenario())
+    assert all(path and path.endswith(".mp3") for path, _ in results)
+    assert controller.held == sum(a["fragments"] for a in busy)
+
+
+def test_search_returns_its_slot_before_post_processing(monkeypatch):
+    controller = BandwidthController(64, 24, 16)
+    monkeypatch.setattr(services, "bandwidth", controller)
+    monkeypatch.setattr(services, "load_yt_dlp", lambda: FakeSearchModule)
+    FakeSearchYoutubeDL.held_after_download = []
+
+    run(services.search_and_download_song("song"))
+    assert FakeSearchYoutubeDL.held_after_download == [0]
+
+
+def test_throttled_host_gets_fewer_connections():
+    controller = BandwidthController(64, 24, 16)
+    first = controller.try_acquire("scontent-ams4-1.cdninstagram.com")
+    controller.record_throttle(first)
+    controller.release(first)
+    second = controller.try_acquire("scontent-fra3-2.cdninstagram.com")
+    controller.record_throttle(second)
+    controller.release(second)
+    # Two levels: the host's limit drops from 24 to 6, two per job
+    allocations = [controller.try_acquire("scontent-waw1-1.cdninstagram.com") for _ in range(3)]
+    assert [a["fragments"] for a in allocations] == [2, 2, 2]
+    assert controller.try_acquire("scontent.cdninstagram.com") is None
+
+
+def test_throttle_burst_raises_penalty_once():
+    controller = BandwidthController(64, 24, 16)
+    allocations = [controller.try_acquire("a.example.com"), controller.try_acquire("b.example.com")]
+    for allocation in allocations:
+        controller.record_throttle(allocation)
+    assert controller.hosts["example.com"]["penalty"] == 1
+
+
+def test_ratelimit_is_split_by_connections_held():
+    controller = BandwidthController(64, 64, 16, bandwidth_limit=64 * 1000)
+    allocations = [controller.try_acquire(f"a{i}.example.com") for i in range(4)]
+    assert sum(a["ratelimit"] for a in allocations) <= 64 * 1000
+
+
+def test_idle_hosts_are_pruned(monkeypatch):
+    controller = BandwidthController(64, 24, 16)
+    controller.release(controller.try_acquire("a.example.com"))
+    throttled = controller.try_acquire("b.example.org")
+    controller.record_throttle(throttled)
+    controller.release(throttled)
+    monkeypatch.setattr(BandwidthController, "HOST_IDLE_TTL", -1)
+    controller.release(controller.try_acquire("c.example.net"))
+    assert set(controller.hosts) == {"example.org"}
+
+
+def test_registrable_domain():
+    assert registrable_domain("rr3---sn-4g5e6nsz.googlevideo.com") == "googlevideo.com"
+    assert registrable_domain("media.bbc.co.uk") == "bbc.co.uk"
+    assert registrable_domain("127.0.0.1") == "127.0.0.1"
+
+
+def test_search_and_media_share_the_cdn_key():
+    probed = {"url": "https://rr5---sn-abc.googlevideo.com/videoplayback?id=1"}
+    assert services.download_host("https://www.youtube.com/watch?v=dQw4w9WgXcQ", probed) == "googlevideo.com"
+    assert services.download_host("https://youtu.be/dQw4w9WgXcQ") == "googlevideo.com"
+    assert services.download_host("https://www.youtube.com/") == "googlevideo.com"
@@ -0,0 +1,104 @@
+"""
+Short-link resolution against a local redirect server, and link detection in free text.
+"""
+import re
+
+from aiohttp import web
+
+import database
+import services
+from test_database import use_temp_db
+from test_fast_extractors import run, start_server
+
+
+async def to_video(request):
+    raise web.HTTPFound("/@catlover/video/7312345678901234567?is_from_webapp=1")
+
+
+async def to_login(request):
+    raise web.HTTPFound("/login?redirect_url=%2Ft%2FZT8abc%2F")
+
+
+async def to_missing(request):
+    raise web.HTTPFound("/@catlover/video/404")
+
+
+async def page(request):
+    return web.Response(text="<html></html>", content_type="text/html")
+
+
+async def not_found(request):
+    return web.Response(status=404)
+
+
+def resolve(path, monkeypatch):
+    monkeypatch.setattr(services, "PLATFORMS", {"127.0.0.1": "tiktok"})
+
+    async def scenario():
+        server = await start_server({
+            "/t/video/": to_video,
+            "/t/login/": to_login,
+            "/t/missing/": to_missing,
+            "/@catlover/video/7312345678901234567": page,
+            "/@catlover/video/404": not_found,
+            "/login": page,
+        })
+        try:
+            short = str(server.make_url(path))
+            base = str(server.make_url("/")).rstrip("/")
+            return short, base, await services.resolve_short_link(short), await database.get_redirect(short, 3600)
+        finally:
+            await server.close()
+
+    return run(scenario())
+
+
+def test_resolve_short_link_caches_media_target(monkeypatch, tmp_path):
+    use_temp_db(monkeypatch, tmp_path)
+    short, base, target, cached = resolve("/t/video/", monkeypatch)
+    assert target == base + "/@catlover/video/7312345678901234567"
+    assert cached == target
+
+
+def test_resolve_short_link_ignores_non_media_target(monkeypatch, tmp_path):
+    use_temp_db(monkeypatch, tmp_path)
+    short, base, target, cached = resolve("/t/login/", monkeypatch)
+    assert target == short
+    assert cached is None
+
+
+def test_resolve_short_link_ignores_error_status(monkeypatch, tmp_path):
+    use_temp_db(monkeypatch, tmp_path)
+    short, base, target, cached = resolve("/t/missing/", monkeypatch)
+    assert target == short
+    assert cached is None
+
+
+def test_redirects_expire(monkeypatch, tmp_path):
+    use_temp_db(monkeypatch, tmp_path)
+
+    async def scenario():
+        await database.save_redirect("https://vm.tiktok.com/ZM1/", "https://www.tiktok.com/@a/video/1")
+        async with database.aiosqlite.connect(database.DB_NAME) as db:
+            await db.execute("UPDATE url_redirects SET created_at = datetime('now', '-2 hours')")
+            await db.commit()
+        return (
+            await database.get_redirect("https://vm.tiktok.com/ZM1/", 3600),
+            await database.get_redirect("https://vm.tiktok.com/ZM1/", 3 * 3600),
+        )
+
+    assert run(scenario()) == (None, "https://www.tiktok.com/@a/video/1")
+
+
+def test_extract_url_accepts_bare_platform_hosts():
+    assert services.extract_url("look instagram.com/reel/ABC/?igsh=xyz") == "instagram.com/reel/ABC/?igsh=xyz"
+    assert services.extract_url("vm.tiktok.com/ZM123/ lol") == "vm.tiktok.com/ZM123/"
+    assert services.extract_url("mail me at bob@instagram.com/x") is None
+    assert services.extract_url("notinstagram.com/reel/ABC/") is None
+
+
+def test_bot_link_filter_accepts_bare_platform_hosts():
+    pattern = re.compile(services.LINK_PATTERN)
+    assert pattern.search("instagram.com/reel/ABC/?igsh=xyz")
+    assert pattern.search("https://example.com/page")
+    assert not pattern.search("just chatting")
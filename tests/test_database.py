@@ -0,0 +1,58 @@
+"""Job queue and analytics rollups against a temporary SQLite database."""
+import asyncio
+
+import database
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def use_temp_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "bot.db"))
+    monkeypatch.setattr(database, "_event_buffer", [])
+    run(database.init_db())
+
+
+def test_jobs_keep_the_sender(monkeypatch, tmp_path):
+    use_temp_db(monkeypatch, tmp_path)
+
+    async def scenario():
+        job_id = await database.add_job("video", "https://youtu.be/x", -100123, 55, 42)
+        await database.update_job(job_id, "running", 1)
+        return await database.get_unfinished_jobs()
+
+    [(job_id, kind, payload, chat_id, status_id, user_id, attempts, age)] = run(scenario())
+    assert (kind, chat_id, status_id, user_id, attempts) == ("video", -100123, 55, 42, 1)
+
+
+def test_rollups_count_senders_not_chats(monkeypatch, tmp_path):
+    use_temp_db(monkeypatch, tmp_path)
+
+    async def scenario():
+        # Three members of one group chat, one of them twice
+        for user_id in (1, 2, 3, 3):
+            database.track_event("download", "tiktok", True, 1.5, user_id)
+        database.track_event("download", "tiktok", False, 30, 1)
+        await database.flush_events()
+        database.track_event("search", "youtube", True, 0.4, 2)
+        await database.flush_events()
+        return await database.get_dashboard(days=7)
+
+    dashboard = run(scenario())
+    assert dashboard["dau"] == 3
+    assert dashboard["mau"] == 3
+    assert dashboard["kinds"]["download"] == (5, 4)
+    assert dashboard["kinds"]["search"] == (1, 1)
+    assert dashboard["top_platforms"] == [("tiktok", 5)]
+
+
+def test_events_retention_uses_index(monkeypatch, tmp_path):
+    use_temp_db(monkeypatch, tmp_path)
+
+    async def scenario():
+        async with database.aiosqlite.connect(database.DB_NAME) as db:
+            async with db.execute("EXPLAIN QUERY PLAN DELETE FROM events WHERE ts < 0") as cursor:
+                return " ".join(str(row) for row in await cursor.fetchall())
+
+    assert "idx_events_ts" in run(scenario())
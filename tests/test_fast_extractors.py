@@ -0,0 +1,191 @@
+"""
+Fast extractors against recorded TikTok/Instagram pages served by a local aiohttp server.
+The pages' CDN origin is replaced with the local server, which also serves the media bytes.
+"""
+import asyncio
+import os
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import services
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+MEDIA_BYTES = b"\x00\x00\x00\x18ftypmp42" + b"\x01" * 4096
+
+
+def load_fixture(name, base):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read().replace("__MEDIA_BASE__", base)
+
+
+async def start_server(routes):
+    app = web.Application()
+    for path, handler in routes.items():
+        app.router.add_get(path, handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def fixture_page(name):
+    async def handler(request):
+        base = str(request.url.origin())
+        return web.Response(text=load_fixture(name, base), content_type="text/html")
+    return handler
+
+
+async def media(request):
+    return web.Response(body=MEDIA_BYTES, content_type="video/mp4")
+
+
+def run(coro):
+    async def wrapper():
+        try:
+            return await coro
+        finally:
+            await services.close_http_session()
+    return asyncio.run(wrapper())
+
+
+def test_extract_tiktok_reads_rehydration_data():
+    async def scenario():
+        server = await start_server({"/@catlover/video/7312345678901234567": fixture_page("tiktok_video.html")})
+        try:
+            session = await services.get_http_session()
+            base = str(server.make_url("/")).rstrip("/")
+            info = await services.extract_tiktok(session, f"{base}/@catlover/video/7312345678901234567")
+        finally:
+            await server.close()
+        return info, base
+
+    info, base = run(scenario())
+    assert info["id"] == "7312345678901234567"
+    assert info["title"] == "Funny cat compilation #cats"
+    assert info["url"].startswith(base + "/video/tos/")
+    assert info["ext"] == "mp4"
+
+
+def test_extract_tiktok_missing_item_returns_none():
+    async def scenario():
+        server = await start_server({"/@x/video/1": fixture_page("tiktok_blocked.html")})
+        try:
+            session = await services.get_http_session()
+            return await services.extract_tiktok(session, str(server.make_url("/@x/video/1")))
+        finally:
+            await server.close()
+
+    assert run(scenario()) is None
+
+
+def test_extract_instagram_reads_embed_page(monkeypatch):
+    async def scenario():
+        server = await start_server({"/p/{code}/embed/captioned/": fixture_page("instagram_embed.html")})
+        base = str(server.make_url("/")).rstrip("/")
+        monkeypatch.setattr(services, "IG_EMBED_URL", base + "/p/{shortcode}/embed/captioned/")
+        try:
+            session = await services.get_http_session()
+            return await services.extract_instagram(session, "https://www.instagram.com/reel/Cx1AbC2dEfG/")
+        finally:
+            await server.close()
+
+    info = run(scenario())
+    assert info["id"] == "Cx1AbC2dEfG"
+    assert info["title"] == "Sunset timelapse by @traveller"
+    assert "/o1/v/t16/f1/m82/sunset.mp4?" in info["url"]
+
+
+def test_fast_download_fetches_media(monkeypatch, tmp_path):
+    monkeypatch.setattr(services, "DOWNLOAD_PATH", str(tmp_path))
+    monkeypatch.setattr(services, "FAST_EXTRACTORS", {"127.0.0.1": ("tiktok", services.extract_tiktok)})
+
+    async def scenario():
+        server = await start_server({
+            "/@catlover/video/7312345678901234567": fixture_page("tiktok_video.html"),
+            "/video/tos/useast2a/tos-useast2a-ve-0068c001/oQ7abc.mp4": media,
+        })
+        try:
+            return await services.fast_download(str(server.make_url("/@catlover/video/7312345678901234567")))
+        finally:
+            await server.close()
+
+    file_path, title, media_type = run(scenario())
+    assert media_type == "video"
+    assert title == "Funny cat compilation #cats"
+    with open(file_path, "rb") as f:
+        assert f.read() == MEDIA_BYTES
+
+
+def test_fast_download_abandons_oversized_media(monkeypatch, tmp_path):
+    monkeypatch.setattr(services, "DOWNLOAD_PATH", str(tmp_path))
+    monkeypatch.setattr(services, "MAX_UPLOAD_SIZE", 1024)
+    monkeypatch.setattr(services, "FAST_EXTRACTORS", {"127.0.0.1": ("tiktok", services.extract_tiktok)})
+
+    async def scenario():
+        server = await start_server({
+            "/@catlover/video/7312345678901234567": fixture_page("tiktok_video.html"),
+            "/video/tos/useast2a/tos-useast2a-ve-0068c001/oQ7abc.mp4": media,
+        })
+        try:
+            return await services.fast_download(str(server.make_url("/@catlover/video/7312345678901234567")))
+        finally:
+            await server.close()
+
+    assert run(scenario()) is None
+    assert os.listdir(tmp_path) == []
+
+
+class FakeYoutubeDL:
+    calls = []
+
+    def __init__(self, opts):
+        self.opts = opts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=True):
+        FakeYoutubeDL.calls.append(url)
+        return {"id": "fallback", "title": "From yt-dlp", "ext": "mp4", "protocol": "https"}
+
+    def process_ie_result(self, info, download=True):
+        return info
+
+    @staticmethod
+    def sanitize_info(info):
+        return info
+
+    def prepare_filename(self, info):
+        return f"{services.DOWNLOAD_PATH}/{info['id']}.{info['ext']}"
+
+
+class FakeYtDlpModule:
+    YoutubeDL = FakeYoutubeDL
+
+
+def test_download_media_falls_back_to_yt_dlp(monkeypatch, tmp_path):
+    monkeypatch.setattr(services, "DOWNLOAD_PATH", str(tmp_path))
+    monkeypatch.setattr(services, "FAST_EXTRACTORS", {"127.0.0.1": ("tiktok", services.extract_tiktok)})
+    monkeypatch.setattr(services, "load_yt_dlp", lambda: FakeYtDlpModule)
+    FakeYoutubeDL.calls = []
+
+    async def scenario():
+        server = await start_server({"/@x/video/1": fixture_page("tiktok_blocked.html")})
+        try:
+            url = str(server.make_url("/@x/video/1"))
+            return url, await services.download_media(url)
+        finally:
+            await server.close()
+
+    url, (file_path, title, media_type) = run(scenario())
+    assert FakeYoutubeDL.calls == [url]
+    assert title == "From yt-dlp"
+    assert media_type == "video"
+    assert services.EXTRACTOR_STATS["tiktok"]["failed"] >= 1
+
+
+def test_fast_download_skips_unknown_hosts():
+    assert run(services.fast_download("https://example.com/video/1")) is None
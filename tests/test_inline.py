@@ -0,0 +1,71 @@
+"""
+Inline mode: FTS5 query building, prefix search, per-user empty queries and next_offset paging.
+"""
+from aiogram.types import InlineQuery, User
+
+import bot
+import database
+from database import _fts_query, add_cached_media, search_cached_media
+from test_database import run, use_temp_db
+
+
+def test_fts_query_quotes_every_word_as_prefix():
+    assert _fts_query('AC/DC "Live" OR -') == '"ac"* "dc"* "live"* "or"*'
+    assert _fts_query("NEAR(a b)") == '"near"* "a"* "b"*'
+    assert _fts_query("  ¿!  ") == ""
+
+
+def test_search_matches_word_prefixes(monkeypatch, tmp_path):
+    use_temp_db(monkeypatch, tmp_path)
+
+    async def scenario():
+        await add_cached_media("u1", "f1", "audio", "Yulduzlar", "Shahzoda", 1)
+        await add_cached_media("u2", "f2", "audio", "Other song", "Someone", 1)
+        return await search_cached_media("yul sha"), await search_cached_media("AND")
+
+    found, syntax = run(scenario())
+    assert [row[1] for row in found] == ["f1"]
+    assert syntax == []
+
+
+def test_empty_query_lists_only_own_deliveries(monkeypatch, tmp_path):
+    use_temp_db(monkeypatch, tmp_path)
+
+    async def scenario():
+        await add_cached_media("u1", "mine", "video", "Reel", None, 1)
+        await add_cached_media("u2", "theirs", "video", "Private reel", None, 2)
+        return (
+            await search_cached_media("", 1),
+            await search_cached_media("", 3),
+            await search_cached_media(""),
+        )
+
+    own, stranger, anonymous = run(scenario())
+    assert [row[1] for row in own] == ["mine"]
+    assert stranger == []
+    assert anonymous == []
+
+
+def test_inline_handler_pages_with_next_offset(monkeypatch, tmp_path):
+    use_temp_db(monkeypatch, tmp_path)
+    answers = []
+
+    async def answer(self, results, **kwargs):
+        answers.append((len(results), kwargs))
+    monkeypatch.setattr(InlineQuery, "answer", answer)
+
+    user = User(id=7, is_bot=False, first_name="A")
+
+    async def scenario():
+        for i in range(bot.INLINE_PAGE_SIZE + 5):
+            await add_cached_media(f"u{i}", f"f{i}", "audio", f"Song {i}", "Band", 7)
+        await bot.inline_query_handler(InlineQuery(id="1", from_user=user, query="song", offset=""))
+        await bot.inline_query_handler(InlineQuery(id="2", from_user=user, query="song", offset=answers[0][1]["next_offset"]))
+        await bot.inline_query_handler(InlineQuery(id="3", from_user=user, query="", offset=""))
+
+    run(scenario())
+    (first, first_kw), (second, second_kw), (own, own_kw) = answers
+    assert (first, first_kw["next_offset"]) == (bot.INLINE_PAGE_SIZE, str(bot.INLINE_PAGE_SIZE))
+    assert (second, second_kw["next_offset"]) == (5, "")
+    assert not first_kw["is_personal"]
+    assert own == bot.INLINE_PAGE_SIZE and own_kw["is_personal"]
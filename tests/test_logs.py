@@ -0,0 +1,51 @@
+"""
+Logging pipeline filters: redaction of the formatted message and DEBUG sampling.
+"""
+import asyncio
+import logging
+
+import services
+from logs import PrivacyFilter, SamplingFilter
+
+
+def make_record(level, msg, *args, name="bot"):
+    return logging.LogRecord(name, level, __file__, 1, msg, args or None, None)
+
+
+def test_privacy_filter_redacts_args():
+    record = make_record(logging.ERROR, "Update %s raised exception: %s", "chat id=123 from @someone", "token=abc-1")
+    PrivacyFilter().filter(record)
+    assert record.getMessage() == "Update chat id=*** from @*** raised exception: token=***"
+
+
+def test_privacy_filter_redacts_long_ids():
+    record = make_record(logging.WARNING, "user 123456789 blocked the bot")
+    PrivacyFilter().filter(record)
+    assert record.getMessage() == "user ***ID*** blocked the bot"
+
+
+def test_sampling_filter_uses_nearest_configured_logger():
+    sampler = SamplingFilter({"aiogram": 0.0, "aiogram.event": 1.0}, 1.0)
+    assert not sampler.filter(make_record(logging.DEBUG, "x", name="aiogram.dispatcher"))
+    assert sampler.filter(make_record(logging.DEBUG, "x", name="aiogram.event.handler"))
+    assert sampler.filter(make_record(logging.DEBUG, "x", name="services"))
+    assert sampler.filter(make_record(logging.WARNING, "x", name="aiogram.dispatcher"))
+
+
+def test_service_diagnostics_go_through_logging(monkeypatch, caplog):
+    async def broken(session, url):
+        raise RuntimeError("blocked token=abc-1")
+    monkeypatch.setattr(services, "FAST_EXTRACTORS", {"example.com": ("tiktok", broken)})
+
+    async def scenario():
+        try:
+            return await services.fast_probe("https://example.com/@user/video/1")
+        finally:
+            await services.close_http_session()
+
+    with caplog.at_level(logging.WARNING):
+        assert asyncio.run(scenario()) is None
+    record = caplog.records[-1]
+    assert record.levelno == logging.WARNING and record.args[0] == "tiktok"
+    PrivacyFilter().filter(record)
+    assert record.getMessage() == "tiktok probe error: blocked token=***"
@@ -0,0 +1,91 @@
+"""Probe stage: fast-extractor probes, probe reuse by download_media, and trimmed yt-dlp infos."""
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import services
+from test_fast_extractors import FakeYtDlpModule, FakeYoutubeDL, MEDIA_BYTES, fixture_page
+
+
+def setup_services(monkeypatch, tmp_path):
+    monkeypatch.setattr(services, "DOWNLOAD_PATH", str(tmp_path))
+    monkeypatch.setattr(services, "FAST_EXTRACTORS", {"127.0.0.1": ("tiktok", services.extract_tiktok)})
+    monkeypatch.setattr(services, "probe_cache", services.TTLCache(ttl=60, maxsize=8))
+    monkeypatch.setattr(services, "load_yt_dlp", lambda: FakeYtDlpModule)
+    FakeYoutubeDL.calls = []
+
+
+def test_fast_host_probe_skips_yt_dlp_and_is_reused(monkeypatch, tmp_path):
+    setup_services(monkeypatch, tmp_path)
+    hits = {"page": 0, "media": 0}
+
+    async def page(request):
+        hits["page"] += 1
+        return await fixture_page("tiktok_video.html")(request)
+
+    async def media(request):
+        hits["media"] += 1
+        return web.Response(body=MEDIA_BYTES, content_type="video/mp4")
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/@catlover/video/7312345678901234567", page)
+        app.router.add_get("/video/tos/useast2a/tos-useast2a-ve-0068c001/oQ7abc.mp4", media)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            url = str(server.make_url("/@catlover/video/7312345678901234567"))
+            summary, error = await services.probe_media(url)
+            result = await services.download_media(url)
+            return summary, error, result
+        finally:
+            await server.close()
+            await services.close_http_session()
+
+    summary, error, (file_path, title, media_type) = asyncio.run(scenario())
+    assert error is None
+    assert summary["duration"] == 14
+    assert summary["title"] == "Funny cat compilation #cats"
+    assert title == "Funny cat compilation #cats"
+    assert FakeYoutubeDL.calls == []
+    # The download reused the probe: one page fetch in total
+    assert hits == {"page": 1, "media": 1}
+
+
+def test_fast_probe_rejects_too_long(monkeypatch, tmp_path):
+    setup_services(monkeypatch, tmp_path)
+    monkeypatch.setattr(services, "MAX_DURATION", 10)
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/@catlover/video/1", fixture_page("tiktok_video.html"))
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            return await services.probe_media(str(server.make_url("/@catlover/video/1")))
+        finally:
+            await server.close()
+            await services.close_http_session()
+
+    assert asyncio.run(scenario()) == (None, "too_long")
+
+
+def test_trim_probe_keeps_only_selected_formats():
+    video = {"format_id": "137", "url": "https://cdn/v", "fragments": [{"path": "a"}]}
+    audio = {"format_id": "140", "url": "https://cdn/a"}
+    info = {
+        "id": "abc",
+        "title": "T",
+        "duration": 60,
+        "formats": [video, audio] + [{"format_id": str(i)} for i in range(50)],
+        "requested_formats": [video, audio],
+        "automatic_captions": {"en": [{"url": "x"}] * 100},
+        "thumbnails": [{"url": "t"}] * 40,
+        "thumbnail": "https://i/t.jpg",
+    }
+    trimmed = services.trim_probe(info)
+    assert [f["format_id"] for f in trimmed["formats"]] == ["137", "140"]
+    assert "automatic_captions" not in trimmed and "thumbnails" not in trimmed
+    assert trimmed["thumbnail"] == "https://i/t.jpg"
+    assert services.probe_summary(trimmed)["duration"] == 60
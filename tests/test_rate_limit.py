@@ -0,0 +1,101 @@
+"""
+RateLimitMiddleware token buckets, action classification and cooldown notifications.
+"""
+import asyncio
+from datetime import datetime
+
+from aiogram.types import CallbackQuery, Chat, Message, User
+
+import middlewares
+from middlewares import ACTION_COSTS, RateLimitMiddleware, classify_action
+
+USER = User(id=42, is_bot=False, first_name="A")
+CHAT = Chat(id=42, type="private")
+
+
+def message(text):
+    return Message(message_id=1, date=datetime.now(), chat=CHAT, from_user=USER, text=text)
+
+
+def callback(data):
+    return CallbackQuery(id="1", from_user=USER, chat_instance="c", data=data)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def use_clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(middlewares.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def test_classify_action():
+    assert classify_action(message("/start")) == "command"
+    assert classify_action(message("https://www.tiktok.com/@a/video/1")) == "link"
+    assert classify_action(message("instagram.com/reel/ABC/")) == "link"
+    assert classify_action(message("yulduz yulduz")) == "search"
+    assert classify_action(callback("dl_music")) == "dl_music"
+    assert classify_action(callback("admin_channels")) == "callback"
+
+
+def test_consume_spends_and_refills(monkeypatch):
+    clock = use_clock(monkeypatch)
+    limiter = RateLimitMiddleware(capacity=10, refill=1)
+    assert limiter.consume(1, 8) == 0
+    assert limiter.consume(1, 4) == 2
+    clock.now += 2
+    assert limiter.consume(1, 4) == 0
+    # Other users have their own bucket
+    assert limiter.consume(2, 10) == 0
+
+
+def test_idle_buckets_are_evicted(monkeypatch):
+    clock = use_clock(monkeypatch)
+    limiter = RateLimitMiddleware(capacity=10, refill=1)
+    limiter.consume(1, 5)
+    clock.now += 5
+    limiter.consume(2, 5)
+    clock.now += 6
+    limiter.consume(3, 1)
+    assert list(limiter.buckets) == [2, 3]
+
+
+def test_rejected_user_is_notified_once_per_cooldown(monkeypatch):
+    clock = use_clock(monkeypatch)
+    monkeypatch.setattr(middlewares, "ADMIN_IDS", [])
+
+    async def not_admin(user_id):
+        return False
+    monkeypatch.setattr(middlewares, "check_admin", not_admin)
+
+    replies = []
+
+    async def answer(self, text=None, **kwargs):
+        replies.append(text)
+    monkeypatch.setattr(Message, "answer", answer)
+
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.text)
+
+    limiter = RateLimitMiddleware(capacity=ACTION_COSTS["link"] * 2, refill=0.1)
+
+    async def paste_links(count):
+        for i in range(count):
+            await limiter(handler, message(f"https://www.tiktok.com/@a/video/{i}"), {})
+
+    asyncio.run(paste_links(50))
+    assert len(handled) == 2
+    assert len(replies) == 1
+
+    # A new cooldown window gets a new notice
+    clock.now += 100
+    asyncio.run(paste_links(10))
+    assert len(replies) == 2